@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares the built-in ID3v2/FLAC parsers of tagcat with taglib.
+
+Every file is read with ``tagcat.fast_tags`` and with taglib and the
+results have to be equal, files the parsers hand over to taglib are
+counted as fallbacks.  Without a directorie a synthetic library is
+generated with ``synth.py`` and extended by variants (ID3v2.3, UTF-16,
+multiple values, padded and VBR frames, ID3v1 trailers, ...).
+
+Usage:
+    python benchmarks/differential.py -n 1000
+    python benchmarks/differential.py /home/music
+
+"""
+
+
+import os
+import sys
+import struct
+import shutil
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import synth  # noqa: E402
+import tagcat  # noqa: E402
+
+
+TAGS = {"ARTIST": "Artist", "ALBUM": "Album", "TITLE": "Title ümlaut",
+        "TRACKNUMBER": "3/12", "DATE": "1999", "GENRE": "Rock"}
+
+
+def frame(fid, data, version=4):
+    """Builds a raw ID3v2 frame.
+    """
+
+    size = synth.syncsafe(len(data)) if version == 4 else \
+        struct.pack(">I", len(data))
+    return fid.encode("ascii") + size + b"\x00\x00" + data
+
+
+def text(s, enc=3):
+    """Encodes a text frame body.
+    """
+
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}[enc]
+    delim = b"\x00\x00" if enc in (1, 2) else b"\x00"
+    return bytes([enc]) + delim.join(v.encode(codec) for v in s.split("|"))
+
+
+def mpeg(header, count, padded=False):
+    """Builds ``count`` MPEG frames, with ``padded`` every other frame
+    has the padding bit set.
+    """
+
+    b = tagcat.mpeg_header(header + b"\x00" * 4096, 0, check=False)
+    retval = b""
+    for i in range(count):
+        h = bytearray(header)
+        if padded and i % 2:
+            h[2] |= 2
+        n = b[4] + (1 if padded and i % 2 else 0)
+        retval += bytes(h) + b"\x00" * (n - 4)
+    return retval
+
+
+def xing(header, frames, size):
+    """Builds a first frame carrying a Xing header.
+    """
+
+    b = tagcat.mpeg_header(header + b"\x00" * 4096, 0, check=False)
+    data = header + b"\x00" * 32 + b"Xing" + struct.pack(">III", 3,
+                                                         frames, size)
+    return data + b"\x00" * (b[4] - len(data))
+
+
+def id3(frames, version=4, padding=64):
+    body = b"".join(frames) + b"\x00" * padding
+    return b"ID3" + bytes([version, 0, 0]) + synth.syncsafe(len(body)) + body
+
+
+def variants():
+    """Yields ``(name, bytes)`` of files the synthetic library lacks.
+    """
+
+    tags = [frame(f, text(v)) for f, v in (("TPE1", "Artist"),
+                                          ("TALB", "Album"),
+                                          ("TIT2", "Title"))]
+    cbr = b"\xff\xfb\x90\x64"
+
+    yield "v23.mp3", id3([frame(f, text(v, 1), 3) for f, v in
+                          (("TPE1", "Ärtist"), ("TIT2", "Tïtle"),
+                           ("TCON", "Jazz"))], 3) + mpeg(cbr, 10)
+    yield "v23-year.mp3", id3([frame("TYER", text("1999", 0), 3)] +
+                              [frame("TIT2", text("T", 0), 3)], 3) + \
+        mpeg(cbr, 10)
+    yield "utf16be.mp3", id3([frame("TPE1", text("A|B", 2))] + tags[1:]) + \
+        mpeg(cbr, 10)
+    yield "multi.mp3", id3(tags + [frame("TCON", text("Rock|Pop"))]) + \
+        mpeg(cbr, 10)
+    yield "emptyfield.mp3", id3([frame("TPE1", text("|B"))] + tags[1:]) + \
+        mpeg(cbr, 10)
+    yield "emptyutf16.mp3", id3([frame("TPE1", b"\x01")] + tags[1:]) + \
+        mpeg(cbr, 10)
+    yield "bomonly.mp3", id3([frame("TPE1", b"\x01\xff\xfe")] +
+                             tags[1:]) + mpeg(cbr, 10)
+    yield "numgenre.mp3", id3(tags + [frame("TCON", text("17"))]) + \
+        mpeg(cbr, 10)
+    yield "comment.mp3", id3(tags + [frame("COMM", b"\x01eng\xff\xfe\x00"
+                                           b"\x00" + "hi".encode("utf-16"))]
+                             ) + mpeg(cbr, 10)
+    yield "commdesc.mp3", id3(tags + [frame("COMM", b"\x00engd\x00x")]) + \
+        mpeg(cbr, 10)
+    yield "txxx.mp3", id3(tags + [frame("TXXX", text("KEY|value"))]) + \
+        mpeg(cbr, 10)
+    yield "apic.mp3", id3(tags + [frame("APIC", b"\x00image/jpeg\x00\x03"
+                                        b"\x00" + b"\xff" * 64)]) + \
+        mpeg(cbr, 10)
+    yield "padded.mp3", id3(tags) + mpeg(cbr, 40, padded=True)
+    yield "mono.mp3", id3(tags) + mpeg(b"\xff\xfb\x90\xc4", 12)
+    yield "mpeg2.mp3", id3(tags) + mpeg(b"\xff\xf3\x80\x64", 30)
+    yield "id3v1.mp3", id3(tags) + mpeg(cbr, 10) + b"TAG" + b"\x00" * 125
+    yield "garbage.mp3", id3(tags) + mpeg(cbr, 10) + b"\x01" * 300
+    yield "xing.mp3", id3(tags) + xing(cbr, 2000, 900000) + mpeg(cbr, 9)
+    yield "noframes.mp3", id3(tags) + b"\x00" * 100
+    yield "labelonly.mp3", id3([frame("TPUB", text("L"))]) + mpeg(cbr, 10)
+    yield "unsync.mp3", b"ID3\x04\x00\x80" + id3(tags)[6:] + mpeg(cbr, 4)
+
+    yield "plain.flac", synth.flac(dict(TAGS, comment="lower key"))
+    yield "long.flac", synth.flac(TAGS, seconds=600, padding=0)
+    yield "empty.flac", synth.flac({"TITLE": "", "ARTIST": "A"})
+    yield "notags.flac", synth.flac({})
+    yield "picture.flac", synth.flac(dict(TAGS, COVERART="xx"))
+    yield "id3v1.flac", synth.flac(TAGS) + b"TAG" + b"\x00" * 125
+    yield "id3.flac", id3([frame("TPE1", text("ID3 Artist"))] + tags[1:]) + \
+        synth.flac(dict(TAGS, ARTIST="Vorbis Artist"))
+    yield "flac.mp3", synth.flac(TAGS)
+
+
+def corpus(root, n, depth):
+    """Writes a synthetic library and the variants below ``root``.
+    """
+
+    retval = synth.generate(os.path.join(root, "library"), n, depth)
+    d = os.path.join(root, "variants")
+    os.makedirs(d)
+    for name, data in variants():
+        fn = os.path.join(d, name)
+        with open(fn, "wb") as fd:
+            fd.write(data)
+        retval.append(fn)
+
+    return retval
+
+
+def compare(files, verbose=False):
+    """Reads every file with both readers.
+
+    Returns:
+        tuple: ``(equal, fallbacks, mismatches)`` counts.
+
+    """
+
+    equal = fallbacks = mismatches = 0
+
+    for fn in files:
+        for props in (True, False):
+            fast = tagcat.fast_tags(fn, props=props)
+            if fast is None:
+                fallbacks += 1
+                if verbose:
+                    print("fallback {0} props={1}".format(fn, props))
+                continue
+
+            afile = tagcat.taglib.File(fn)
+            slow = tagcat.file_tags(afile, props=props)
+            afile.close()
+
+            if list(fast.items()) == list(slow.items()):
+                equal += 1
+            else:
+                mismatches += 1
+                print("MISMATCH {0} props={1}".format(fn, props))
+                for k in sorted(set(fast) | set(slow)):
+                    if fast.get(k) != slow.get(k):
+                        print("  {0}: {1!r} != {2!r}".format(
+                            k, fast.get(k), slow.get(k)))
+
+    return equal, fallbacks, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks/differential.py")
+    parser.add_argument("dirs", metavar="DIR", nargs="*")
+    parser.add_argument("-n", "--files", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    tmp = None
+    try:
+        if args.dirs:
+            files = tagcat.filewalk(args.dirs, recursiv=True,
+                                    test=tagcat.isaudio)
+        else:
+            tmp = tempfile.mkdtemp(prefix="tagcat-diff-")
+            files = corpus(tmp, args.files, args.depth)
+
+        equal, fallbacks, mismatches = compare(files, args.verbose)
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+    print("{0} equal, {1} fallbacks, {2} mismatches".format(
+        equal, fallbacks, mismatches))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Checks that grep queries give the same files with and without the index.
+
+A synthetic library is generated with ``synth.py`` and every query runs
+three times: file by file without an index, through the index after a
+walk and with ``-I`` on the index alone.  The index narrows regular
+expressions down by the trigrams of their literals, so the queries focus
+on patterns whose literals are easy to get wrong.  Regular expressions
+match at the start of the value, like ``re.match``.
+
+Usage:
+    python benchmarks/queries.py -n 1000
+
+"""
+
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import synth  # noqa: E402
+import tagcat  # noqa: E402
+
+
+QUERIES = [r"genre=rock",
+           r"NOT genre=rock",
+           r"artist^=Artist AND NOT genre=pop",
+           r"title~.*ümlaut",
+           r"artist~\x41rtist",
+           r"artist~Artist",
+           r"artist~\U00000041rtist",
+           r'artist~"\N{LATIN CAPITAL LETTER A}rtist"',
+           r"artist~\101rtist",
+           r"artist~[^]x]rtist",
+           r"artist~[]A]rtist",
+           r"artist~[\]A]rtist",
+           r"artist~\drtist",
+           r"artist~Art\.?ist",
+           r"label~la.el\s1[0-2]",
+           r"comment~\sripped\sby"]
+
+
+def run(root, queries):
+    """Runs every query with and without the index.
+
+    Returns:
+        int: The number of queries whose results differ.
+
+    """
+
+    indexfile = tagcat.INDEXFILE
+    mismatches = 0
+
+    for q in queries:
+        tagcat.close_index()
+        tagcat.INDEXFILE = ""
+        plain = set(tagcat.query_tags([root], q, recursiv=True))
+        tagcat.INDEXFILE = indexfile
+        walked = set(tagcat.query_tags([root], q, recursiv=True))
+        indexed = set(tagcat.query_tags([root], q, recursiv=True,
+                                        indexed=True))
+
+        ok = plain == walked == indexed
+        mismatches += not ok
+        print("{0:<8} {1:>6} {2:>6} {3:>6}  {4}".format(
+            "ok" if ok else "MISMATCH", len(plain), len(walked),
+            len(indexed), q))
+
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks/queries.py")
+    parser.add_argument("-n", "--files", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=2)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="tagcat-queries-")
+    try:
+        root = os.path.join(tmp, "library")
+        synth.generate(root, args.files, args.depth)
+        tagcat.INDEXFILE = os.path.join(tmp, "index.db")
+        mismatches = run(os.path.abspath(root), QUERIES)
+        tagcat.close_index()
+    finally:
+        shutil.rmtree(tmp)
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Times the tagcat subcommands on synthetic libraries.
+
+For every size a fresh library is generated with ``synth.py`` in a
+temporary directorie and every benchmark runs against it in order, so the
+mutating benchmarks (write, cleanup, rename) come last.  The results are
+written as JSON to be diffed between versions.
+
+Usage:
+    python benchmarks/run.py --sizes 1000 100000 1000000 -o results.json
+
+"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import synth  # noqa: E402
+import tagcat  # noqa: E402
+
+
+def bench_filewalk(root, files):
+    return tagcat.filewalk([root], recursiv=True, test=tagcat.isaudio)
+
+
+def bench_filewalk_i(root, files):
+    return tagcat.filewalk_i([root], recursiv=True, test=tagcat.isaudio)
+
+
+def bench_merge_tags_noindex(root, files):
+    indexfile = tagcat.INDEXFILE
+    tagcat.INDEXFILE = ""
+    try:
+        return tagcat.merge_tags(files)
+    finally:
+        tagcat.INDEXFILE = indexfile
+
+
+def bench_merge_tags_cold(root, files):
+    return tagcat.merge_tags(files)
+
+
+def bench_merge_tags_warm(root, files):
+    return tagcat.merge_tags(files)
+
+
+def bench_grep_tags(root, files):
+    return tagcat.grep_tags(files, ["genre"], "rock")
+
+
+def bench_gen_filename(root, files):
+    return [tagcat.gen_filename(fn) for fn in files]
+
+
+def bench_write_tags(root, files):
+    return tagcat.write_tags(files, {"genre": "Benchmark"})
+
+
+def bench_clear_tags(root, files):
+    return tagcat.clear_tags(files)
+
+
+def bench_rename(root, files):
+    return tagcat.rename(files)
+
+
+BENCHMARKS = [bench_filewalk,
+              bench_filewalk_i,
+              bench_merge_tags_noindex,
+              bench_merge_tags_cold,
+              bench_merge_tags_warm,
+              bench_grep_tags,
+              bench_gen_filename,
+              bench_write_tags,
+              bench_clear_tags,
+              bench_rename]
+
+
+def version():
+    """Returns the git revision of the tagcat checkout, if any.
+    """
+
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(HERE), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(size, depth, only=None):
+    """Runs all benchmarks on a fresh library of ``size`` files.
+
+    Returns:
+        list: A list of result dicts.
+
+    """
+
+    retval = []
+    tmp = tempfile.mkdtemp(prefix="tagcat-bench-")
+
+    try:
+        root = os.path.join(tmp, "library")
+        t = time.perf_counter()
+        files = synth.generate(root, size, depth)
+        print("generated {0} files in {1:.2f}s".format(
+            size, time.perf_counter() - t), file=sys.stderr)
+
+        tagcat.BASEDIR = os.path.join(tmp, "music")
+        tagcat.INDEXFILE = os.path.join(tmp, "index.db")
+
+        for bench in BENCHMARKS:
+            name = bench.__name__[len("bench_"):]
+            if only and name not in only:
+                continue
+
+            t = time.perf_counter()
+            with open(os.devnull, "w") as null, \
+                    contextlib.redirect_stdout(null):
+                bench(root, files)
+                tagcat.close_index()
+            seconds = time.perf_counter() - t
+
+            retval.append({"benchmark": name,
+                           "files": size,
+                           "depth": depth,
+                           "seconds": seconds,
+                           "files_per_sec": size / seconds
+                           if seconds else None})
+            print("{0:>8} {1:<20} {2:10.3f}s".format(size, name, seconds),
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp)
+
+    return retval
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks/run.py")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000])
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("-b", "--benchmarks", nargs="+")
+    parser.add_argument("-o", "--output", default="-")
+    args = parser.parse_args()
+
+    results = {"version": version(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "results": []}
+
+    for size in args.sizes:
+        results["results"].extend(run(size, args.depth, args.benchmarks))
+
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Generates synthetic audio libraries for the benchmarks.
+
+Every file is a tiny but valid MP3 (ID3v2.4 tag and a few MPEG frames) or
+FLAC (STREAMINFO, VORBIS_COMMENT and PADDING blocks and one frame) with a
+realistic set of tags.  The files are written byte by byte, taglib is not
+needed to create a library.
+
+Usage:
+    python benchmarks/synth.py -n 1000 --depth 2 /tmp/library
+
+"""
+
+
+import os
+import math
+import struct
+import argparse
+
+
+TRACKS = 12
+MP3FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+FLACFRAME = b"\xff\xf8\x69\x08\x00\x00" + b"\x00" * 64
+GENRES = ["Rock", "Pop", "Jazz", "Techno", "House", "Dub", "Ambient"]
+
+
+def syncsafe(n):
+    """Encodes ``n`` as a 28 bit syncsafe integer.
+    """
+
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f,
+                  n & 0x7f])
+
+
+def id3_frame(fid, text):
+    """Builds an ID3v2.4 text frame, COMM frames get a language and an
+    empty description.
+    """
+
+    data = text.encode("utf-8")
+    if fid == "COMM":
+        data = b"eng\x00" + data
+
+    data = b"\x03" + data
+    return fid.encode("ascii") + syncsafe(len(data)) + b"\x00\x00" + data
+
+
+def mp3(tags, frames=8, padding=512):
+    """Returns the bytes of a MP3 file with the given tags.
+    """
+
+    ids = {"ARTIST": "TPE1", "ALBUMARTIST": "TPE2", "ALBUM": "TALB",
+           "TITLE": "TIT2", "TRACKNUMBER": "TRCK", "DISCNUMBER": "TPOS",
+           "DATE": "TDRC", "GENRE": "TCON", "LABEL": "TPUB",
+           "COMMENT": "COMM"}
+
+    body = b"".join(id3_frame(ids[t], v) for t, v in tags.items())
+    body += b"\x00" * padding
+    header = b"ID3\x04\x00\x00" + syncsafe(len(body))
+
+    return header + body + MP3FRAME * frames
+
+
+def flac_block(btype, data, last=False):
+    """Builds a FLAC metadata block.
+    """
+
+    return bytes([btype | (0x80 if last else 0)]) + \
+        len(data).to_bytes(3, "big") + data
+
+
+def flac(tags, seconds=3, padding=512):
+    """Returns the bytes of a FLAC file with the given tags.
+    """
+
+    rate, channels, bps = 44100, 2, 16
+    v = (rate << 44) | ((channels - 1) << 41) | ((bps - 1) << 36) | \
+        (rate * seconds)
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\x00" * 6 + \
+        v.to_bytes(8, "big") + b"\x00" * 16
+
+    vendor = b"tagcat synth"
+    comments = [("{0}={1}".format(t, v)).encode("utf-8")
+                for t, v in tags.items()]
+    vorbis = struct.pack("<I", len(vendor)) + vendor + \
+        struct.pack("<I", len(comments)) + \
+        b"".join(struct.pack("<I", len(c)) + c for c in comments)
+
+    return b"fLaC" + flac_block(0, streaminfo) + flac_block(4, vorbis) + \
+        flac_block(1, b"\x00" * padding, last=True) + FLACFRAME
+
+
+def leafdirs(n, depth):
+    """Yields relative directories so that ``n`` files spread over
+    ``depth`` directory levels with about ``TRACKS`` files per leaf.
+    """
+
+    leaves = max(1, math.ceil(n / TRACKS))
+    fanout = max(1, math.ceil(leaves ** (1.0 / max(depth, 1))))
+
+    for i in range(leaves):
+        parts = []
+        for _ in range(depth):
+            parts.append("d{0:03d}".format(i % fanout))
+            i //= fanout
+        yield os.path.join(*reversed(parts)) if parts else ""
+
+
+def generate(root, n, depth=2, flacratio=0.5):
+    """Writes a synthetic library of ``n`` files below ``root``.
+
+    Args:
+        root: The target directorie.
+        n: The number of files.  ``int``
+        depth: The number of directorie levels.  ``int``
+        flacratio: The share of FLAC files.  ``float``
+
+    Returns:
+        list: The absolute filenames of the library.
+
+    """
+
+    retval = []
+    count = 0
+
+    for album, d in enumerate(leafdirs(n, depth)):
+        d = os.path.join(root, d)
+        os.makedirs(d, exist_ok=True)
+
+        for track in range(1, TRACKS + 1):
+            if count == n:
+                return retval
+
+            tags = {"ARTIST": "Artist {0}".format(album // 5),
+                    "ALBUMARTIST": "Artist {0}".format(album // 5),
+                    "ALBUM": "Album {0}".format(album),
+                    "TITLE": "Title {0} ümlaut".format(count),
+                    "TRACKNUMBER": "{0}/{1}".format(track, TRACKS),
+                    "DISCNUMBER": "1",
+                    "DATE": str(1970 + album % 50),
+                    "GENRE": GENRES[album % len(GENRES)],
+                    "LABEL": "Label {0}".format(album % 13),
+                    "COMMENT": " ripped by synth "}
+
+            isflac = (count % 100) < flacratio * 100
+            fn = os.path.join(d, "{0:02d}.{1}".format(
+                track, "flac" if isflac else "mp3"))
+
+            with open(fn, "wb") as fd:
+                fd.write(flac(tags) if isflac else mp3(tags))
+
+            retval.append(os.path.abspath(fn))
+            count += 1
+
+    return retval
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="synth")
+    parser.add_argument("root", metavar="DIR")
+    parser.add_argument("-n", "--files", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--flac", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(len(generate(args.root, args.files, args.depth, args.flac)))
+
+
+if __name__ == "__main__":
+    main()
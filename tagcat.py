@@ -13,20 +13,44 @@ Coretags
 
 TODO
 ===
-* grep with multi tags, empty value, has tags...
 * rename with artist not albumartist when all artist fields are equal
 * tracknumber 0 ???
 """
 
 
 import os
+import stat
+import select
+import time
+import errno
+import shutil
+import shlex
 import argparse
-import taglib
+import configparser
+import importlib
+import pathlib
 import re
+import json
+import mmap
+import array
+import heapq
+import hashlib
+import struct
+import contextlib
+import collections
+import threading
+import itertools
+import queue
+import functools
+import concurrent.futures
 
 
 os.sys.setrecursionlimit(15000)
 BASEDIR = "/home/music"
+TEMPLATE = "{albumartist}/{album}/{tracknumber:02d}-{artist}-{title}"
+INDEXFILE = os.environ.get("TAGCAT_INDEX",
+                           os.path.join(os.path.expanduser("~"), ".cache",
+                                        "tagcat", "index.db"))
 CLEANTAGS = ["ARTIST",
              "ALBUMARTIST",
              "ALBUM",
@@ -43,18 +67,110 @@ CLEANTAGS = ["ARTIST",
              "CATALOGNUMBER",
              "PUBLISHER",
              "LABEL"]
+PROPS = ("samplerate", "lenght", "bitrate", "channels")
+AUDIOEXT = (".mp3", ".MP3", ".flac", ".FLAC")
+JPGEXT = (".jpg", ".JPG", ".jpeg", ".JPEG")
+PLANVERSION = 1
+
+
+class LazyModule(object):
+    """Stands in for a module which is imported on the first attribute
+    access.  taglib is only needed when the built-in parsers give up and
+    sqlite3 only when the index is opened.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+
+taglib = LazyModule("taglib")
+sqlite3 = LazyModule("sqlite3")
 
 
 def main():
     """This is main, not sparta!
     """
 
-    if len(os.sys.argv) <= 2:
+    global STATS, AIO, AIO_MOUNT, JOURNAL, SCAN_THREADS, SCAN_ORDERED
+
+    parser = argparse.ArgumentParser(prog="tagcat", add_help=False)
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--slowest", type=int, default=10, metavar="N")
+    parser.add_argument("--profile", metavar="FILE")
+    parser.add_argument("--aio", type=int, default=0, metavar="N")
+    parser.add_argument("--aio-mount", type=int, default=0, metavar="N")
+    parser.add_argument("--scan-threads", type=int, default=0, metavar="N")
+    parser.add_argument("--scan-ordered", action="store_true")
+    parser.add_argument("--journal", metavar="FILE")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--checkpoint", type=int, default=256, metavar="N")
+    parser.add_argument("jmp", nargs="?", metavar="COMMAND")
+    parser.add_argument("argv", nargs=argparse.REMAINDER)
+    opts = parser.parse_args(os.sys.argv[1:])
+
+    if not opts.argv and opts.jmp not in ("shell", "sh", "watch", "w",
+                                          "import", "im"):
         help()
         raise AttributeError
 
-    jmp = os.sys.argv[1]
-    argv = os.sys.argv[2:]
+    if opts.stats:
+        STATS = Stats(slowest=opts.slowest)
+
+    AIO = opts.aio
+    AIO_MOUNT = opts.aio_mount
+    SCAN_THREADS = opts.scan_threads
+    SCAN_ORDERED = opts.scan_ordered
+
+    if opts.journal:
+        try:
+            JOURNAL = Journal(opts.journal, [opts.jmp] + opts.argv,
+                              resume=opts.resume, checkpoint=opts.checkpoint)
+        except (OSError, ValueError) as err:
+            print("tagcat: journal {0}: {1}".format(opts.journal, err),
+                  file=os.sys.stderr)
+            os.sys.exit(1)
+
+    profile = None
+    if opts.profile:
+        import cProfile
+        profile = cProfile.Profile()
+
+    try:
+        if profile:
+            profile.enable()
+        dispatch(opts.jmp, opts.argv)
+    except sqlite3.OperationalError as err:
+        print("tagcat: index: {0}".format(err), file=os.sys.stderr)
+        os.sys.exit(1)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(opts.profile)
+        if JOURNAL is not None:
+            JOURNAL.close()
+        close_index()
+        if STATS is not None:
+            STATS.report()
+
+
+class UnknownCommand(ValueError):
+    """Raised by ``dispatch`` for an unknown subcommand.
+    """
+
+
+def dispatch(jmp, argv):
+    """Runs the subcommand ``jmp`` with the arguments ``argv``.
+
+    Raises:
+        UnknownCommand: If there is no subcommand ``jmp``.
+
+    """
 
     if jmp == "list" or jmp == "ls":
         tc_list(argv)
@@ -62,6 +178,9 @@ def main():
     elif jmp == "write" or jmp == "wr":
         tc_write(argv)
 
+    elif jmp == "edit" or jmp == "ed":
+        tc_edit(argv)
+
     elif jmp == "delete" or jmp == "del":
         tc_delete(argv)
 
@@ -80,36 +199,520 @@ def main():
     elif jmp == "grep" or jmp == "g":
         tc_grep(argv)
 
+    elif jmp == "watch" or jmp == "w":
+        tc_watch(argv)
+
+    elif jmp == "dupes" or jmp == "du":
+        tc_dupes(argv)
+
+    elif jmp == "export" or jmp == "ex":
+        tc_export(argv)
+
+    elif jmp == "import" or jmp == "im":
+        tc_import(argv)
+
+    elif jmp == "shell" or jmp == "sh":
+        tc_shell(argv)
+
+    elif jmp == "apply" or jmp == "ap":
+        tc_apply(argv)
+
     else:
-        raise ValueError
+        raise UnknownCommand(jmp)
 
 
 def help():
     """Prints the main help for tagcat.
     """
-    s = "usage: tagcat [list|write|swipe|delete|clear|rename] ..."
+    s = "usage: tagcat [--stats [--slowest N]] [--profile FILE] " \
+        "[--aio N [--aio-mount N]] " \
+        "[--scan-threads N [--scan-ordered]] " \
+        "[--journal FILE [--resume] [--checkpoint N]] " \
+        "[list|write|edit|swipe|delete|clear|rename|auto|grep|watch|" \
+        "dupes|export|import|apply|shell] ...\n" \
+        "\n" \
+        "       tagcat list [-r] [-j N] [--no-props] [-I] [-k N] FILE ...\n" \
+        "              -k N: top N values of mixed tags, exact counts " \
+        "up to N values, ~ marks estimates\n" \
+        "       tagcat watch [-d SECONDS] [--no-scan] [DIR ...]\n" \
+        "       tagcat dupes [-r] [-j N] FILE ...\n" \
+        "       tagcat export [-r] [-j N] [--no-props] FILE ...\n" \
+        "       tagcat import [-d] [-j N] [FILE]"
 
     print(s)
 
 
-def filewalk_i(ls, recursiv=False, test=os.path.isfile):
+STATS = None
+JOURNAL = None
+
+
+class Journal(object):
+    """A write-ahead journal of the work a command has finished.
+
+    The first line holds the command, every further line a finished
+    ``[kind, filename]`` pair, like ``["tag", fn]`` once the tags of ``fn``
+    are saved or ``["move", fn]`` once ``fn`` is moved.  Lines are flushed
+    and synced every ``checkpoint`` entries, so a crash repeats at most
+    that many files.  All journaled work is idempotent, a repeated file
+    ends up the same.
+
+    Raises:
+        ValueError: If ``resume`` is set and the journal is from another
+            command.
+
+    """
+
+    def __init__(self, fn, command, resume=False, checkpoint=256):
+        self.done = set()
+        self.checkpoint = max(checkpoint, 1)
+        self.pending = 0
+        self.lock = threading.Lock()
+
+        header = json.dumps(command, ensure_ascii=False)
+
+        if resume and os.path.exists(fn):
+            with open(fn, "rb") as fd:
+                lines = fd.read().split(b"\n")
+
+            first = lines[0].decode("utf-8")
+            if first != header:
+                raise ValueError("written by `{0}`".format(
+                    " ".join(json.loads(first or "[]"))))
+
+            for line in lines[1:-1]:
+                self.done.add(tuple(json.loads(line.decode("utf-8"))))
+
+            # cut a torn last line before appending
+            os.truncate(fn, os.path.getsize(fn) - len(lines[-1]))
+            self.fd = open(fn, "a", encoding="utf-8")
+        else:
+            self.fd = open(fn, "w", encoding="utf-8")
+            self.fd.write(header + "\n")
+            self.sync()
+
+    def __contains__(self, item):
+        return item in self.done
+
+    def add(self, item):
+        """Appends a finished ``(kind, filename)`` pair.
+        """
+
+        with self.lock:
+            self.done.add(item)
+            self.fd.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self.pending += 1
+            if self.pending >= self.checkpoint:
+                self.sync()
+
+    def sync(self):
+        """Flushes the journal and syncs it to disk.
+        """
+
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.fd.close()
+
+
+def journaled(kind, fn):
+    """Tests if ``--resume`` can skip the work ``kind`` on ``fn``.
     """
+
+    return JOURNAL is not None and (kind, os.path.abspath(fn)) in JOURNAL
+
+
+def journal(kind, fn):
+    """Records that the work ``kind`` on ``fn`` is finished.
     """
 
-    retval = []
+    if JOURNAL is not None:
+        JOURNAL.add((kind, os.path.abspath(fn)))
+
+
+class Stats(object):
+    """Collects wall time, file counts and bytes per phase of a command.
+    """
+
+    def __init__(self, slowest=10):
+        self.seconds = collections.defaultdict(float)
+        self.files = collections.defaultdict(int)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.slowest = []
+        self.n = slowest
+
+    def add(self, name, seconds, fn=None):
+        """Adds ``seconds`` spent in phase ``name`` on the file ``fn``.
+        """
+
+        self.seconds[name] += seconds
+
+        if fn is None:
+            return
+
+        self.files[name] += 1
+        item = (seconds, name, str(fn))
+        if len(self.slowest) < self.n:
+            heapq.heappush(self.slowest, item)
+        elif self.slowest and item > self.slowest[0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def report(self, out=os.sys.stderr):
+        """Prints the collected statistics.
+        """
+
+        print("{0:<8} {1:>10} {2:>8} {3:>10}".format(
+            "phase", "seconds", "files", "files/s"), file=out)
+        for name, seconds in sorted(self.seconds.items()):
+            n = self.files[name]
+            print("{0:<8} {1:>10.3f} {2:>8} {3:>10}".format(
+                name, seconds, n or "",
+                int(n / seconds) if n and seconds else ""), file=out)
+
+        print("read: {0} bytes, written: {1} bytes".format(
+            self.bytes_read, self.bytes_written), file=out)
+
+        for seconds, name, fn in sorted(self.slowest, reverse=True):
+            print("{0:10.3f} {1:<8} {2}".format(seconds, name, fn), file=out)
+
+
+@contextlib.contextmanager
+def phase(name, fn=None):
+    """Measures the time spent in the block as phase ``name`` if ``--stats``
+    is enabled.
+    """
+
+    if STATS is None:
+        yield
+        return
+
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        STATS.add(name, time.perf_counter() - t, fn)
+
+
+def timed(name, it):
+    """Measures the time spent in the iterator ``it`` as phase ``name``.
+    """
+
+    if STATS is None:
+        yield from it
+        return
+
+    it = iter(it)
+    while True:
+        t = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            STATS.add(name, time.perf_counter() - t)
+            return
+        STATS.add(name, time.perf_counter() - t)
+        STATS.files[name] += 1
+        yield item
+
+
+AIO = 0
+AIO_MOUNT = 0
+
+
+@functools.lru_cache(maxsize=4096)
+def mountpoint(d):
+    """Returns the mount point of the directorie ``d``.
+    """
+
+    d = os.path.abspath(d)
+    while not os.path.ismount(d):
+        d = os.path.dirname(d)
+
+    return d
+
+
+def aio_map(func, ls, limit=None, mount_limit=None):
+    """Runs ``func`` on every file of ``ls`` from an asyncio event loop.
+
+    The blocking calls run in a thread executor.  At most ``limit`` calls
+    run at once and at most ``mount_limit`` on the same mount point, twice
+    ``limit`` calls are queued to keep the mounts busy.  This pays off on
+    network mounts where every open costs a round trip.
+
+    Args:
+        func: A function taking a filename.
+        ls: An iterable of filenames.
+        limit: The number of concurrent calls, defaults to ``AIO``.
+        mount_limit: The number of concurrent calls per mount point,
+            defaults to ``AIO_MOUNT``.  0 means no limit.
+
+    Yields:
+        tuple: The filename and the result of ``func``, in the order of
+            ``ls``.
+
+    """
+
+    import asyncio
+
+    limit = max(limit or AIO, 1)
+    mount_limit = AIO_MOUNT if mount_limit is None else mount_limit
+
+    loop = asyncio.new_event_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(limit)
+    semaphores = {}
+
+    async def call(fn):
+        if not mount_limit:
+            return await loop.run_in_executor(executor, func, fn)
+
+        mp = mountpoint(os.path.dirname(os.path.abspath(fn)))
+        if mp not in semaphores:
+            semaphores[mp] = asyncio.Semaphore(mount_limit)
+
+        async with semaphores[mp]:
+            return await loop.run_in_executor(executor, func, fn)
+
+    pending = collections.deque()
+
+    try:
+        for fn in ls:
+            pending.append((fn, loop.create_task(call(fn))))
+            if len(pending) >= 2 * limit:
+                fn, task = pending.popleft()
+                yield fn, loop.run_until_complete(task)
+
+        while pending:
+            fn, task = pending.popleft()
+            yield fn, loop.run_until_complete(task)
+    finally:
+        for _, task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(
+                *[t for _, t in pending], return_exceptions=True))
+        executor.shutdown()
+        loop.close()
+
+
+_walkmemo = None
+SCAN_THREADS = 0
+SCAN_ORDERED = False
+
+
+def iwalk(ls, recursiv=False, test=os.path.isfile):
+    """Like ``_iwalk``, but timed as phase ``walk``.
+    """
+
+    return timed("walk", _iwalk(ls, recursiv=recursiv, test=test))
+
+
+def _iwalk(ls, recursiv=False, test=os.path.isfile):
+    """Yields valid files from an iterable of paths as soon as they are found.
+    Directories are walked iteratively with ``os.scandir``.  For ``isaudio``
+    and ``isjpg`` the file extension and the cached ``DirEntry`` type are
+    checked instead of calling ``test``, so walking doesn't stat any file.
+
+    Args:
+        ls: An iterable of files/directories.
+        recursiv: Find files recursivly.  ``bool``
+        test: A function to test against each file/string.  ``func``
+
+    Yields:
+        str: A filename that passes ``test``.
+
+    """
 
     for fd in ls:
-        if recursiv:
-            for root, dirs, files in os.walk(fd):
-                for f in files:
-                    if test(os.path.join(root, f)):
-                        retval.append(os.path.join(root, f))
+        if not (recursiv and os.path.isdir(fd)):
+            if test(fd):
+                yield fd
+        elif _walkmemo is not None:
+            yield from _memo_tree(fd, test)
+        elif SCAN_THREADS > 1:
+            yield from scan_tree(fd, test, SCAN_THREADS, SCAN_ORDERED)
+        else:
+            yield from _scan_tree(fd, test)
+
+
+def _scan_tree(fd, test, mtimes=None):
+    """Yields the files below the directorie ``fd`` that pass ``test``.
+    If ``mtimes`` is a dict, the mtime of every scanned directorie is
+    stored in it.
+    """
+
+    stack = [fd]
+    while stack:
+        d = stack.pop()
+        files, dirs = _scan_dir(d, test, mtimes)
+        yield from files
+        stack.extend(reversed(dirs))
+
+
+def _scan_dir(d, test, mtimes=None):
+    """Reads the directorie ``d`` with a single ``os.scandir``.
+
+    Returns:
+        tuple: The files that pass ``test`` and the subdirectories, both
+            in directorie order.
 
+    """
+
+    exts = {isaudio: AUDIOEXT, isjpg: JPGEXT}.get(test)
+    files, dirs = [], []
+
+    try:
+        it = os.scandir(d)
+        if mtimes is not None:
+            mtimes[d] = os.stat(d).st_mtime_ns
+    except OSError:
+        return files, dirs
+
+    with it:
+        for entry in it:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    dirs.append(entry.path)
+            elif exts is not None:
+                if entry.name.endswith(exts) and \
+                   entry.is_file(follow_symlinks=False):
+                    files.append(entry.path)
+            elif test(entry.path):
+                files.append(entry.path)
+
+    return files, dirs
+
+
+def scan_tree(fd, test, threads=4, ordered=False):
+    """Yields the files below the directorie ``fd`` that pass ``test``,
+    the directories are read by ``threads`` threads.
+
+    Every thread has its own deque of directories and works it depth
+    first from the right end.  Found subdirectories are pushed on the own
+    deque and a thread running dry steals from the left end of the other
+    deques, where the big subtrees near the top wait.  The files of a
+    directorie are passed on through a queue as soon as it is read, so
+    the consumer runs while the threads are still scanning.  An error
+    while reading a directorie is passed on as well and raised by the
+    consumer.
+
+    Args:
+        fd: A directorie.
+        test: A function to test against each file/string.  ``func``
+        threads: The number of scanning threads.  ``int``
+        ordered: Yield the files in the order of ``_scan_tree`` instead
+            of the order the directories are read in.  ``bool``
+
+    Yields:
+        str: A filename that passes ``test``.
+
+    """
+
+    deques = [collections.deque() for _ in range(threads)]
+    deques[0].append(fd)
+    results = queue.SimpleQueue()
+    stop = threading.Event()
+    wakeup = threading.Condition()
+
+    def steal(i):
+        for j in range(1, threads):
+            try:
+                return deques[(i + j) % threads].popleft()
+            except IndexError:
+                pass
+        return None
+
+    def worker(i):
+        own = deques[i]
+        while not stop.is_set():
+            try:
+                d = own.pop()
+            except IndexError:
+                d = steal(i)
+            if d is None:
+                with wakeup:
+                    wakeup.wait(0.01)
+                continue
+
+            try:
+                files, dirs = _scan_dir(d, test)
+            except Exception as err:
+                results.put((d, None, err))
+                continue
+
+            if dirs:
+                own.extend(reversed(dirs))
+                with wakeup:
+                    wakeup.notify(len(dirs))
+            results.put((d, files, dirs))
+
+    pool = [threading.Thread(target=worker, args=(i,), daemon=True)
+            for i in range(threads)]
+    for t in pool:
+        t.start()
+
+    try:
+        if ordered:
+            done = {}
+            stack = [fd]
+            while stack:
+                d = stack.pop()
+                while d not in done:
+                    r = results.get()
+                    done[r[0]] = r[1:]
+                files, dirs = done.pop(d)
+                if files is None:
+                    raise dirs
+                yield from files
+                stack.extend(reversed(dirs))
         else:
-            if test(fd):
-                retval.append(fd)
+            pending = 1
+            while pending:
+                _, files, dirs = results.get()
+                if files is None:
+                    raise dirs
+                pending += len(dirs) - 1
+                yield from files
+    finally:
+        stop.set()
+        with wakeup:
+            wakeup.notify_all()
+        for t in pool:
+            t.join()
+
+
+def _memo_tree(fd, test):
+    """Like ``_scan_tree``, but keeps the result in ``_walkmemo``.
+
+    A remembered walk is reused as long as no directorie in the tree has a
+    new mtime, that is no entry was added, removed or renamed.
+    """
 
-    return retval
+    key = (fd, test)
+
+    if key in _walkmemo:
+        mtimes, files = _walkmemo[key]
+        try:
+            if all(os.stat(d).st_mtime_ns == mtime
+                   for d, mtime in mtimes.items()):
+                return files
+        except OSError:
+            pass
+
+    mtimes = {}
+    files = list(_scan_tree(fd, test, mtimes))
+    _walkmemo[key] = (mtimes, files)
+
+    return files
+
+
+def filewalk_i(ls, recursiv=False, test=os.path.isfile):
+    """Like ``filewalk``, but keeps the filenames as they are found.
+    """
+
+    return list(iwalk(ls, recursiv=recursiv, test=test))
 
 
 def filewalk(ls, recursiv=False, test=os.path.isfile):
@@ -117,8 +720,6 @@ def filewalk(ls, recursiv=False, test=os.path.isfile):
     test function.  If an item of the given list is a directorie and recursiv
     is set True, filewalk finds valid files recursively in that directorie.
 
-    helllo
-
     Args:
         ls: A list of files/directories.  ``list[str]``
         recursiv: Find files recursivly.  ``bool``
@@ -141,27 +742,7 @@ def filewalk(ls, recursiv=False, test=os.path.isfile):
     if not callable(test):
         raise TypeError("``test`` is not a ``function``")
 
-    def recursion(index, retval):
-        # pylint: disable=unused-variable
-
-        # basecase
-        if index == len(ls):
-            return retval
-
-        # do something with `ls[index]` and `retval`
-        if recursiv and os.path.isdir(ls[index]):
-            for root, dirs, files in os.walk(ls[index]):
-                for fn in files:
-                    ls.append(os.path.join(root, fn))
-        else:
-            if test(ls[index]):
-                retval.append(os.path.abspath(ls[index]))
-
-        # recusrion
-        return recursion(index+1, retval)
-
-    # start and set default values for `index` and `retval`
-    return recursion(0, [])
+    return [os.path.abspath(fn) for fn in iwalk(ls, recursiv, test)]
 
 
 def isaudio(fn):
@@ -181,16 +762,7 @@ def isaudio(fn):
     if not isinstance(fn, str):
         raise TypeError("``fn`` is not a ``str``")
 
-    if not os.path.isfile(fn):
-        return False
-
-    elif os.path.isfile(fn) and os.path.islink(fn):
-        return False
-
-    elif not fn.endswith((".mp3", ".MP3", ".flac", ".FLAC")):
-        return False
-
-    return True
+    return fn.endswith(AUDIOEXT) and isregular(fn)
 
 
 def isjpg(fn):
@@ -210,21 +782,26 @@ def isjpg(fn):
     if not isinstance(fn, str):
         raise TypeError("``fn`` is not a ``str``")
 
-    if not os.path.isfile(fn):
-        return False
+    return fn.endswith(JPGEXT) and isregular(fn)
 
-    elif os.path.isfile(fn) and os.path.islink(fn):
-        return False
 
-    elif not fn.endswith((".jpg", ".JPG", ".jpeg", ".JPEG")):
-        return False
+def isregular(fn):
+    """Test with a single ``lstat`` if `fn` is a regular file and no link.
+    """
 
-    return True
+    try:
+        return stat.S_ISREG(os.lstat(fn).st_mode)
+    except OSError:
+        return False
 
 
-def read_tags(fn):
+def read_tags(fn, props=True):
     """Reads tags from an audio file.
 
+    Args:
+        fn: A filename.
+        props: Include the audio properties (``PROPS``).  ``bool``
+
     Returns:
         dict: A dictinary with the tag, value pairs.
 
@@ -234,734 +811,3962 @@ def read_tags(fn):
     """
 
     try:
-        afile = taglib.File(fn)
-        tags = afile.tags
-        info = {"path": [afile.path],
-                "samplerate": [str(afile.sampleRate)],
-                "lenght": [str(afile.length)],
-                "bitrate": [str(afile.bitrate)],
-                "channels": [str(afile.channels)]}
-        tags.update(info)
-        afile.close()
+        with phase("parse", fn):
+            tags = fast_tags(fn, props=props) if FASTPARSE else None
+            if tags is None:
+                afile = taglib.File(fn)
+                tags = file_tags(afile, props=props)
+                afile.close()
     except OSError:
         tags = {}
 
+    if STATS is not None and tags:
+        STATS.bytes_read += os.path.getsize(fn)
+
     return tags
 
 
-def merge_tags(ls):
-    """Merges all tags together in one dict.
-    """
+def file_tags(afile, props=True):
+    """Collects the tags and audio properties of an open ``taglib.File``.
 
-    if not isinstance(ls, list):
-        raise TypeError("``ls`` is not an instance from ``list``")
+    Returns:
+        dict: A dictinary with the tag, value pairs.
 
-    if len(ls) == 0:
-        return {}
+    """
 
-    def recursion(index, retval, memo):
+    tags = dict(afile.tags)
+    tags["path"] = [str(afile.path)]
 
-        # basecase
-        if index >= len(ls):
-            return retval
+    if props:
+        info = {"samplerate": [str(afile.sampleRate)],
+                "lenght": [str(afile.length)],
+                "bitrate": [str(afile.bitrate)],
+                "channels": [str(afile.channels)]}
+        tags.update(info)
 
-        # do stuff to retval and memo
-        tags = read_tags(ls[index])
-        for tag in set(list(retval.keys()) + list(tags.keys())) - set(memo):
-            try:
-                if retval[tag] != tags[tag]:
-                    raise KeyError
-            except KeyError:
-                retval[tag] = ["~"]
-                memo.append(tag)
+    return tags
 
-        # recursion
-        return recursion(index+1, retval, memo)
 
-    # start recursion and set default values
-    return recursion(1, read_tags(ls[0]), [])
+ID3FRAMES = {"TALB": "ALBUM",
+             "TPE1": "ARTIST",
+             "TPE2": "ALBUMARTIST",
+             "TPE3": "CONDUCTOR",
+             "TPE4": "REMIXER",
+             "TIT1": "WORK",
+             "TIT2": "TITLE",
+             "TIT3": "SUBTITLE",
+             "TRCK": "TRACKNUMBER",
+             "TPOS": "DISCNUMBER",
+             "TDRC": "DATE",
+             "TDOR": "ORIGINALDATE",
+             "TCON": "GENRE",
+             "TCOM": "COMPOSER",
+             "TEXT": "LYRICIST",
+             "TPUB": "LABEL",
+             "TBPM": "BPM",
+             "TCOP": "COPYRIGHT",
+             "TENC": "ENCODEDBY",
+             "TSSE": "ENCODING",
+             "TSRC": "ISRC",
+             "TLAN": "LANGUAGE",
+             "TMED": "MEDIA",
+             "TKEY": "INITIALKEY",
+             "TSOA": "ALBUMSORT",
+             "TSOP": "ARTISTSORT",
+             "TSO2": "ALBUMARTISTSORT",
+             "TSOT": "TITLESORT",
+             "TSOC": "COMPOSERSORT",
+             "COMM": "COMMENT"}
+ID3SKIP = ("APIC", "PRIV", "GEOB", "MCDI")
+ID3BASIC = ("TIT2", "TPE1", "TALB", "COMM", "TCON", "TDRC", "TRCK")
+ID3CODECS = ("latin-1", "utf-16", "utf-16-be", "utf-8")
+MPEGBITRATES = ((0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352,
+                 384, 416, 448),
+                (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256,
+                 320, 384),
+                (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224,
+                 256, 320),
+                (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192,
+                 224, 256),
+                (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144,
+                 160))
+MPEGRATES = {3: (44100, 48000, 32000),
+             2: (22050, 24000, 16000),
+             0: (11025, 12000, 8000)}
+FASTPARSE = True
+
+
+def fast_tags(fn, props=True):
+    """Reads tags like ``read_tags`` but with the built-in ID3v2 and FLAC
+    parsers, the file is memory-mapped and only the metadata is touched.
+    Like taglib the parser is picked by the file extension, a file not
+    starting with the matching magic bytes is left to taglib.
 
+    Returns:
+        dict: A dictinary with the tag, value pairs or None if the file
+        has to be read by taglib.
 
-def print_tags(tags):
-    """Prints tags to stdout
     """
-    l = 0
-    for k in tags.keys():
-        if len(k) > l:
-            l = len(k)
 
-    s = ""
-    for tag in sorted(tags):
-        s += "{0:{1}}: `{2}`\n".format(tag.lower(), l+1, "`, `".join(tags[tag]))
-    print(s)
+    if not fn.endswith(AUDIOEXT):
+        return None
 
+    try:
+        with open(fn, "rb") as fd, \
+                mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if fn.lower().endswith(".flac"):
+                if mm[:4] != b"fLaC":
+                    return None
+                parsed = flac_tags(mm, props)
+            else:
+                if mm[:3] != b"ID3":
+                    return None
+                parsed = id3_tags(mm, props)
+    except (OSError, ValueError, IndexError, struct.error,
+            UnicodeDecodeError):
+        return None
+
+    if parsed is None:
+        return None
+
+    tags, info = parsed
+    retval = {k: tags[k] for k in sorted(tags)}
+    retval["path"] = [str(pathlib.PurePath(fn))]
+    if props:
+        retval.update(info)
 
-def tc_list(argv):
-    """
-    """
+    return retval
 
-    parser = argparse.ArgumentParser(prog="tagcat [list|ls]")
-    parser.add_argument("files", metavar="FILE", nargs="+")
-    parser.add_argument("-r", "--recursiv", action="store_true")
-    args = parser.parse_args(argv)
 
-    files = filewalk_i(args.files, recursiv=args.recursiv, test=isaudio)
-    tags = merge_tags(files)
-    print_tags(tags)
+def syncsafe(data):
+    """Decodes a 28 bit syncsafe integer.
+    """
 
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
 
-def tc_write(argv):
-    """Parses arguments from commandline and runs write_tags.
+
+def split_aligned(data, delim):
+    """Splits ``data`` at ``delim`` found on a multiple of its lenght.
     """
-    parser = argparse.ArgumentParser(prog="tagcat [write|wr]")
-    parser.add_argument("files", metavar="FILE", nargs="+")
-    parser.add_argument("-r", "--recursiv", action="store_true")
-    parser.add_argument("-a", "--artist")
-    parser.add_argument("-aa", "--albumartist")
-    parser.add_argument("-A", "--album")
-    parser.add_argument("-t", "--title")
-    parser.add_argument("-n", "--tracknumber")
-    parser.add_argument("-l", "--label")
-    parser.add_argument("-d", "--date")
-    parser.add_argument("-b", "--bpm")
-    # parser.add_argument("-c", "--catalognumber")
-    parser.add_argument("-g", "--genre")
-    parser.add_argument("-s", "--style")
-    parser.add_argument("-c", "--comment")
 
-    tags = vars(parser.parse_args(argv))
+    retval = []
+    start = i = 0
+    while True:
+        i = data.find(delim, i)
+        if i < 0:
+            break
+        if i % len(delim):
+            i += 1
+            continue
+        retval.append(data[start:i])
+        start = i = i + len(delim)
+    retval.append(data[start:])
 
-    recursiv = tags.pop("recursiv")
-    files = filewalk(tags.pop("files"), recursiv=recursiv, test=isaudio)
+    return retval
 
-    write_tags(files, tags)
 
+def id3_text(data, limit=0):
+    """Decodes the fields of a ID3v2 text frame like taglib does, empty
+    fields are dropped unless the frame is split into ``limit`` fields.
+
+    Returns:
+        list: The decoded strings or None if the encoding is unsupported.
 
-def write_tags(ls, tags):
-    """Writes tags to an audiofile.
     """
 
-    def recursion(index):
+    enc = data[0]
+    if enc > 3:
+        return None
 
-        if index == len(ls):
-            return
+    delim = b"\x00\x00" if enc in (1, 2) else b"\x00"
+    data = data[1:]
+    if limit:
+        fields = split_aligned(data, delim)
+        fields = fields[:limit - 1] + [delim.join(fields[limit - 1:])]
+    else:
+        data = data.rstrip(b"\x00")
+        data += b"\x00" * (len(data) % len(delim))
+        fields = split_aligned(data, delim)
 
-        af = taglib.File(ls[index])
-        for t, v in tags.items():
-            if v:
-                af.tags[t.upper()] = [v]
+    retval = []
+    for field in fields:
+        if enc == 1 and field[:2] not in (b"\xff\xfe", b"\xfe\xff"):
+            if field:
+                return None
+        s = field.decode(ID3CODECS[enc]).split("\x00")[0]
+        if s or limit:
+            retval.append(s)
+
+    return retval
+
+
+def id3_tags(mm, props=True):
+    """Parses the ID3v2.3/2.4 tag and the first MPEG frames of a MP3 file.
+
+    Returns:
+        tuple: The tags and the audio properties or None if the file has
+        to be read by taglib.
+
+    """
+
+    version, flags = mm[3], mm[5]
+    if version not in (3, 4) or flags & 0xc0:
+        return None
+
+    end = 10 + syncsafe(mm[6:10])
+    tags = {}
+    pos = 10
+
+    while pos + 10 <= end:
+        fid = mm[pos:pos + 4]
+        if fid[0] == 0:
+            break
+        if version == 4:
+            size = syncsafe(mm[pos + 4:pos + 8])
+        else:
+            size = struct.unpack(">I", mm[pos + 4:pos + 8])[0]
+        fmt = mm[pos + 9]
+        data = mm[pos + 10:pos + 10 + size]
+        pos += 10 + size
+        fid = fid.decode("latin-1")
+
+        if pos > end or not data:
+            return None
+        if fid in ID3SKIP:
+            continue
+        if fid not in ID3FRAMES or ID3FRAMES[fid] in tags or \
+                fmt & (0x4f if version == 4 else 0xe0):
+            return None
+
+        if fid == "COMM":
+            values = id3_text(data[:1] + data[4:], limit=2)
+            if values is None or values[0]:
+                return None
+            values = [v for v in values[1:] if v]
+        else:
+            values = id3_text(data)
+            if values is None or fid == "TCON" and \
+                    any(v.isdigit() or v.startswith("(") or
+                        v in ("RX", "CR") for v in values):
+                return None
+
+        if not values:
+            return None
+        tags[ID3FRAMES[fid]] = values
+
+    if not any(ID3FRAMES[fid] in tags for fid in ID3BASIC):
+        return None
+
+    info = None
+    if props:
+        info = mpeg_props(mm, end + (10 if flags & 0x10 else 0))
+        if info is None:
+            return None
+
+    return tags, info
+
+
+def mpeg_header(mm, pos, check=True):
+    """Parses the MPEG audio frame header at ``pos``, with ``check`` the
+    next frame has to follow with a matching header.
+
+    Returns:
+        tuple: ``(bitrate, samplerate, channels, samples, lenght)`` or None.
+
+    """
+
+    if pos + 4 > len(mm):
+        return None
+
+    b1, b2, b3 = mm[pos + 1], mm[pos + 2], mm[pos + 3]
+    version, layer = (b1 >> 3) & 3, (b1 >> 1) & 3
+    if mm[pos] != 0xff or b1 == 0xff or b1 & 0xe0 != 0xe0 or \
+            version == 1 or layer == 0 or b2 >> 4 == 15 or \
+            (b2 >> 2) & 3 == 3:
+        return None
+
+    table = 3 - layer if version == 3 else (3 if layer == 3 else 4)
+    bitrate = MPEGBITRATES[table][b2 >> 4]
+    if bitrate == 0:
+        return None
+
+    samplerate = MPEGRATES[version][(b2 >> 2) & 3]
+    samples = 384 if layer == 3 else \
+        (576 if layer == 1 and version != 3 else 1152)
+    lenght = samples * bitrate * 125 // samplerate
+    if b2 & 2:
+        lenght += 4 if layer == 3 else 1
+
+    if check:
+        nxt = mm[pos + lenght:pos + lenght + 4]
+        if len(nxt) < 4 or \
+                struct.unpack(">I", nxt)[0] & 0xfffe0c00 != \
+                struct.unpack(">I", mm[pos:pos + 4])[0] & 0xfffe0c00:
+            return None
+
+    return bitrate, samplerate, 1 if b3 >> 6 == 3 else 2, samples, lenght
+
+
+def mpeg_props(mm, start, scan=65536):
+    """Computes the audio properties of a MP3 file like taglib from the
+    first frame after ``start`` and a Xing/VBRI header or, for constant
+    bitrates, the last frame.
+
+    Returns:
+        dict: The audio properties or None if they can't be determined.
+
+    """
+
+    first = mm.find(b"\xff", start, start + scan)
+    while first >= 0:
+        header = mpeg_header(mm, first)
+        if header is not None:
+            break
+        first = mm.find(b"\xff", first + 1, start + scan)
+    else:
+        return None
+
+    bitrate, samplerate, channels, samples, lenght = header
+    frame = mm[first:first + lenght]
+
+    offset = frame.find(b"Xing")
+    if offset < 0:
+        offset = frame.find(b"Info")
+    if offset >= 0:
+        if len(frame) < offset + 16 or frame[offset + 7] & 3 != 3:
+            return None
+        frames, size = struct.unpack(">II", frame[offset + 8:offset + 16])
+    elif frame.find(b"VBRI") >= 0:
+        offset = frame.find(b"VBRI")
+        size, frames = struct.unpack(">II", frame[offset + 10:offset + 18])
+    else:
+        frames = size = 0
+
+    if frames and size:
+        ms = samples * 1000.0 / samplerate * frames
+        bitrate = int(size * 8.0 / ms + 0.5)
+        ms = int(ms + 0.5)
+    else:
+        last = mpeg_last(mm, first)
+        if last is None:
+            return None
+        ms = int((last - first) * 8.0 / bitrate + 0.5)
+
+    return {"samplerate": [str(samplerate)],
+            "lenght": [str(ms / 1000)],
+            "bitrate": [str(bitrate)],
+            "channels": [str(channels)]}
+
+
+def mpeg_last(mm, first, scan=65536):
+    """Finds the end of the last MPEG frame, taglib searches backwards for
+    a frame followed by another one and counts that one as the last.
+
+    Returns:
+        int: The end offset or None.
+
+    """
+
+    end = len(mm)
+    if end >= 128 and mm[end - 128:end - 125] == b"TAG":
+        end -= 128
+    if mm[end - 32:end - 24] == b"APETAGEX":
+        return None
+
+    pos = end
+    while pos > max(first, end - scan):
+        pos = mm.rfind(b"\xff", max(first, end - scan), pos)
+        if pos < 0:
+            return None
+        if mpeg_header(mm, pos) is not None:
+            header = mpeg_header(mm, pos, check=False)
+            last = pos + header[4]
+            header = mpeg_header(mm, last, check=False)
+            return None if header is None else last + header[4]
+
+    return None
+
+
+def flac_tags(mm, props=True):
+    """Parses the STREAMINFO and VORBIS_COMMENT blocks of a FLAC file.
+
+    Returns:
+        tuple: The tags and the audio properties or None if the file has
+        to be read by taglib.
+
+    """
+
+    pos = 4
+    streaminfo = comment = None
+
+    while True:
+        if pos + 4 > len(mm):
+            return None
+        btype = mm[pos] & 0x7f
+        size = int.from_bytes(mm[pos + 1:pos + 4], "big")
+        data = mm[pos + 4:pos + 4 + size]
+        last = mm[pos] & 0x80
+
+        if btype == 127 or len(data) < size or (pos == 4) != (btype == 0):
+            return None
+        pos += 4 + size
+        if btype == 0:
+            streaminfo = data
+        elif btype == 4 and comment is None:
+            comment = data
+        if last:
+            break
+
+    if comment is None or len(mm) >= 128 and mm[-128:-125] == b"TAG":
+        return None
+
+    tags = {}
+    n = struct.unpack("<I", comment[:4])[0]
+    p = 4 + n
+    count = struct.unpack("<I", comment[p:p + 4])[0]
+    p += 4
+
+    for _ in range(count):
+        n = struct.unpack("<I", comment[p:p + 4])[0]
+        entry = comment[p + 4:p + 4 + n]
+        p += 4 + n
+        if p > len(comment):
+            return None
+        key, sep, value = entry.partition(b"=")
+        key = key.decode("latin-1").upper()
+        if not sep or not key or \
+                any(c < " " or c > "}" or c == "=" for c in key) or \
+                key in ("METADATA_BLOCK_PICTURE", "COVERART"):
+            return None
+        value = value.decode("utf-8").split("\x00")[0]
+        if value:
+            tags.setdefault(key, []).append(value)
+
+    if not tags:
+        return None
+
+    info = None
+    if props:
+        flags, lo = struct.unpack(">II", streaminfo[10:18])
+        samplerate, channels = flags >> 12, ((flags >> 9) & 7) + 1
+        frames = ((flags & 0xf) << 32) | lo
+        bitrate = ms = 0
+        if frames and samplerate:
+            ms = frames * 1000.0 / samplerate
+            bitrate = int((len(mm) - pos) * 8.0 / ms + 0.5)
+            ms = int(ms + 0.5)
+        info = {"samplerate": [str(samplerate)],
+                "lenght": [str(ms / 1000)],
+                "bitrate": [str(bitrate)],
+                "channels": [str(channels)]}
+
+    return tags, info
+
+
+def strip_props(tags):
+    """Removes the audio properties from a tag dict in place.
+    """
+
+    for p in PROPS:
+        tags.pop(p, None)
+
+    return tags
+
+
+def intern(pool, obj):
+    """Returns the object equal to ``obj`` from ``pool``, ``obj`` itself if
+    there is none yet.
+    """
+
+    return pool.setdefault(obj, obj)
+
+
+def intern_values(pool, values):
+    """Interns the strings of a tag value list and the tuple of them.
+    """
+
+    return intern(pool, tuple(intern(pool, str(v)) for v in values))
+
+
+def prop_number(s):
+    """Converts an audio property string to ``int`` or ``float`` so that
+    ``str`` gives ``s`` back.
+    """
+
+    return int(s) if s.isdigit() else float(s)
+
+
+class TagRecord(object):
+    """A compact read-only copy of the tags of one file.
+
+    The tag names and value tuples are interned through ``pool``, so the
+    files of an album share most of them, and the audio properties are kept
+    as numbers.  ``dict`` gives the tags back in the ``read_tags`` shape,
+    without ``path``.
+    """
+
+    __slots__ = ("keys", "values", "props")
+
+    def __init__(self, tags, pool):
+        keys = tuple(intern(pool, t) for t in tags
+                     if t != "path" and t not in PROPS)
+        self.keys = intern(pool, keys)
+        self.values = tuple(intern_values(pool, tags[t]) for t in keys)
+        self.props = None
+
+        if any(p in tags for p in PROPS):
+            self.props = tuple(prop_number(str(tags[p][0]))
+                               if tags.get(p) else None for p in PROPS)
+
+    def dict(self):
+        """Returns the tags as a new dict of lists.
+        """
+
+        tags = {t: list(v) for t, v in zip(self.keys, self.values)}
+
+        if self.props is not None:
+            tags.update((p, [str(v)]) for p, v in zip(PROPS, self.props)
+                        if v is not None)
+
+        return tags
+
+
+class TagBatch(object):
+    """Columnar tags of many files.
+
+    Every tag is a column with the interned value tuple of each file, or
+    None if the file lacks the tag, and every audio property is an ``array``
+    of numbers (NaN if missing).  Aggregations like ``summarize`` run over
+    the columns instead of a dict per file.
+    """
+
+    __slots__ = ("paths", "columns", "props", "pool")
+
+    def __init__(self):
+        self.paths = []
+        self.columns = {}
+        self.props = {p: array.array("d") for p in PROPS}
+        self.pool = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def append(self, fn, tags):
+        """Adds the tags of ``fn`` as a new row.
+        """
+
+        self.paths.append(fn)
+        for column in self.columns.values():
+            column.append(None)
+        for p in PROPS:
+            self.props[p].append(float("nan"))
+
+        self[len(self.paths) - 1] = tags
+
+    def __setitem__(self, i, tags):
+        n = len(self.paths)
+
+        for tag, column in self.columns.items():
+            if tag not in tags:
+                column[i] = None
+
+        for tag, values in tags.items():
+            if tag == "path":
+                continue
+            if tag in PROPS:
+                self.props[tag][i] = float(values[0]) if values else \
+                    float("nan")
+                continue
+            if tag not in self.columns:
+                self.columns[tag] = [None] * n
+            self.columns[tag][i] = intern_values(self.pool, values)
+
+        for p in PROPS:
+            if p not in tags:
+                self.props[p][i] = float("nan")
+
+    def __getitem__(self, i):
+        """Returns the tags of row ``i`` as a new dict of lists.
+        """
+
+        tags = {tag: list(column[i]) for tag, column in self.columns.items()
+                if column[i] is not None}
+
+        for p in PROPS:
+            value = self.props[p][i]
+            if value == value:
+                tags[p] = [prop_string(p, value)]
+
+        tags["path"] = [self.paths[i]]
+
+        return tags
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self.paths)))
+
+    def summarize(self, topk=0):
+        """Summarizes the columns like ``summarize_records``, the top values
+        are counted exactly.
+        """
+
+        n = len(self.paths)
+        summaries = {}
+
+        columns = dict(self.columns)
+        columns["path"] = [(fn,) for fn in self.paths]
+        for p in PROPS:
+            columns[p] = [(prop_string(p, v),) if v == v else None
+                          for v in self.props[p]]
+
+        for tag, column in columns.items():
+            present = [v for v in column if v is not None]
+            if not present:
+                continue
+
+            summary = TagSummary(present[0], k=topk)
+            summary.files = len(present)
+            summary.mixed = any(v != present[0] for v in present)
+
+            if topk:
+                summary.counts = {v: [c, 0] for v, c in collections.Counter(
+                    present).most_common(topk)}
+
+            summaries[tag] = summary
+
+        return n, summaries
+
+
+def prop_string(prop, value):
+    """Formats a numeric audio property like ``file_tags`` does.
+    """
+
+    if prop != "lenght" and value.is_integer():
+        return str(int(value))
+
+    return str(value)
+
+
+INDEXBATCH = 256
+INDEXTIMEOUT = 30.0
+_index = None
+_index_lock = threading.RLock()
+_index_writes = 0
+_index_warned = False
+_index_failed = False
+_memo = None
+_mempool = None
+_mempool_live = 0
+MEMPOOLSLACK = 65536
+
+
+def open_index():
+    """Opens the tag index at ``INDEXFILE`` and creates it if needed.
+
+    The index maps absolute filenames to the tags and audio properties of the
+    file, together with the size and mtime the file had when it was parsed.
+    It may be used from several threads, see ``index_execute``.  The index
+    runs in WAL mode and writes are committed every ``INDEXBATCH`` files, so
+    other tagcat processes can read and write it at the same time.  If the
+    index can't be opened, this is reported once and the commands run
+    without it until ``close_index`` is called.
+
+    Returns:
+        sqlite3.Connection: The index or None if ``INDEXFILE`` is empty or
+            can't be opened.
+
+    """
+
+    global _index, _index_failed
+
+    with _index_lock:
+        if _index is None and INDEXFILE and not _index_failed:
+            try:
+                _index = setup_index()
+            except (OSError, sqlite3.Error) as err:
+                _index_failed = True
+                index_warn(err)
+
+    return _index
+
+
+def setup_index():
+    """Connects to ``INDEXFILE`` and creates or migrates its tables.
+
+    Returns:
+        sqlite3.Connection: The index.
+
+    """
+
+    if not os.path.exists(os.path.dirname(INDEXFILE)):
+        os.makedirs(os.path.dirname(INDEXFILE))
+
+    db = sqlite3.connect(INDEXFILE, timeout=INDEXTIMEOUT,
+                         check_same_thread=False)
+    try:
+        db.execute("PRAGMA journal_mode = WAL")
+
+        # indexes from older versions have no postings yet
+        migrate = not db.execute("SELECT 1 FROM sqlite_master WHERE "
+                                 "name = 'postings'").fetchall()
+
+        db.execute("CREATE TABLE IF NOT EXISTS tags ("
+                   "path TEXT PRIMARY KEY, "
+                   "size INTEGER, "
+                   "mtime INTEGER, "
+                   "tags TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS hashes ("
+                   "path TEXT PRIMARY KEY, "
+                   "size INTEGER, "
+                   "mtime INTEGER, "
+                   "hash TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS keys ("
+                   "id INTEGER PRIMARY KEY, "
+                   "tag TEXT, "
+                   "key TEXT, "
+                   "UNIQUE (tag, key))")
+        db.execute("CREATE TABLE IF NOT EXISTS postings ("
+                   "path TEXT, "
+                   "id INTEGER, "
+                   "value TEXT, "
+                   "PRIMARY KEY (path, id)) WITHOUT ROWID")
+        db.execute("CREATE INDEX IF NOT EXISTS postings_id "
+                   "ON postings (id)")
+        db.execute("CREATE TABLE IF NOT EXISTS trigrams ("
+                   "tri TEXT, "
+                   "id INTEGER, "
+                   "PRIMARY KEY (tri, id)) WITHOUT ROWID")
+        db.execute("CREATE INDEX IF NOT EXISTS trigrams_id "
+                   "ON trigrams (id)")
+        db.execute("CREATE TABLE IF NOT EXISTS unposted ("
+                   "path TEXT PRIMARY KEY)")
+
+        # keys and their trigrams live as long as a file posts them
+        db.execute("CREATE TRIGGER IF NOT EXISTS postings_gc "
+                   "AFTER DELETE ON postings WHEN NOT EXISTS ("
+                   "SELECT 1 FROM postings WHERE id = old.id) BEGIN "
+                   "DELETE FROM keys WHERE id = old.id; "
+                   "DELETE FROM trigrams WHERE id = old.id; END")
+
+        if migrate:
+            db.execute("INSERT OR IGNORE INTO unposted "
+                       "SELECT path FROM tags")
+        db.commit()
+    except sqlite3.Error:
+        db.close()
+        raise
+
+    return db
+
+
+def close_index():
+    """Commits and closes the tag index if it is open.
+    """
+
+    global _index, _index_failed
+
+    with _index_lock:
+        _index_failed = False
+        if _index is not None:
+            commit_index()
+            _index.close()
+            _index = None
+
+
+def commit_index():
+    """Commits pending changes to the tag index.
+
+    Returns:
+        bool: False if the commit failed, see ``index_warn``.
+
+    """
+
+    global _index_writes
+
+    with _index_lock:
+        if _index is not None:
+            try:
+                _index.commit()
+            except sqlite3.OperationalError as err:
+                _index.rollback()
+                index_warn(err)
+                return False
+            finally:
+                _index_writes = 0
+
+    return True
+
+
+def index_written():
+    """Counts a file written to the index and commits every ``INDEXBATCH``
+    files.
+    """
+
+    global _index_writes
+
+    with _index_lock:
+        _index_writes += 1
+        if _index_writes >= INDEXBATCH:
+            commit_index()
+
+
+def index_warn(err):
+    """Reports a failed index access once.  The index is a cache, so the
+    command goes on without it.
+    """
+
+    global _index_warned
+
+    if not _index_warned:
+        _index_warned = True
+        print("Warning: index: {0}".format(err), file=os.sys.stderr)
+
+
+def index_execute(sql, params=()):
+    """Runs a SQL statement on the index while holding the index lock.
+
+    Returns:
+        list: The fetched rows or None if there is no index.
+
+    """
+
+    with _index_lock:
+        db = open_index()
+        if db is None:
+            return None
+
+        return db.execute(sql, params).fetchall()
+
+
+def index_get(fn, st):
+    """Looks up the indexed tags of ``fn``.
+
+    Args:
+        fn: An absolute filename.
+        st: The ``os.stat_result`` of ``fn``.
+
+    Returns:
+        dict: The indexed tags or None if ``fn`` is unknown or has changed.
+
+    """
+
+    if _memo is not None and fn in _memo:
+        size, mtime, record = _memo[fn]
+        if size == st.st_size and mtime == st.st_mtime_ns:
+            return record.dict()
+
+    rows = index_execute("SELECT size, mtime, tags FROM tags WHERE path = ?",
+                         (fn,))
+
+    if not rows or rows[0][0] != st.st_size or rows[0][1] != st.st_mtime_ns:
+        return None
+
+    tags = json.loads(rows[0][2])
+    if _memo is not None:
+        _memo[fn] = (rows[0][0], rows[0][1], TagRecord(tags, _mempool))
+
+    return tags
+
+
+def index_put(fn, tags, st=None):
+    """Stores the tags of ``fn`` in the index.
+
+    Args:
+        fn: A filename.
+        tags: The tags as returned by ``read_tags``.
+        st: The ``os.stat_result`` of ``fn``, taken when ``tags`` were read.
+
+    Returns:
+        bool: False if the index is busy, see ``index_warn``.
+
+    """
+
+    if not INDEXFILE and _memo is None:
+        return True
+
+    fn = os.path.abspath(fn)
+    if st is None:
+        st = os.stat(fn)
+
+    if _memo is not None:
+        _memo[fn] = (st.st_size, st.st_mtime_ns, TagRecord(tags, _mempool))
+
+    with _index_lock:
+        try:
+            index_execute("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)",
+                          (fn, st.st_size, st.st_mtime_ns, json.dumps(tags)))
+            index_execute("INSERT OR IGNORE INTO unposted VALUES (?)", (fn,))
+        except sqlite3.OperationalError as err:
+            index_warn(err)
+            return False
+
+        index_written()
+
+    return True
+
+
+def index_post():
+    """Updates the postings of all files whose tags changed since the last
+    query.
+
+    The first value of every tag is lowercased and stored once as a key per
+    tag, for exact and prefix lookups.  The trigrams of a key narrow down
+    regular expression searches, see ``query_index``.  Files post the keys
+    of their tags together with the original value.  Posting is deferred
+    from ``index_put`` to here, so only grep pays for it and the trigrams
+    are inserted in one sorted batch.
+    """
+
+    with _index_lock:
+        db = open_index()
+        if db is None:
+            return
+
+        db.execute("DELETE FROM postings "
+                   "WHERE path IN (SELECT path FROM unposted)")
+
+        rows = db.execute("SELECT path, tags FROM tags "
+                          "JOIN unposted USING (path)").fetchall()
+        ids = {}
+        postings = []
+        trigrams = []
+
+        for fn, tags in rows:
+            for tag, values in json.loads(tags).items():
+                if tag == "path" or not values:
+                    continue
+
+                value = str(values[0])
+                key = (tag, value.lower())
+
+                if key not in ids:
+                    cur = db.execute("INSERT OR IGNORE INTO keys "
+                                     "VALUES (NULL, ?, ?)", key)
+                    if cur.rowcount:
+                        ids[key] = cur.lastrowid
+                        trigrams.extend((tri, cur.lastrowid)
+                                        for tri in trigrams_of(key[1]))
+                    else:
+                        ids[key] = db.execute(
+                            "SELECT id FROM keys WHERE tag = ? AND key = ?",
+                            key).fetchall()[0][0]
+
+                postings.append((fn, ids[key], value))
+
+        trigrams.sort()
+        db.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+        db.executemany("INSERT INTO trigrams VALUES (?, ?)", trigrams)
+        db.execute("DELETE FROM unposted")
+        commit_index()
+
+
+def index_unpost(db, fn):
+    """Removes the postings of ``fn``, unused keys are dropped by the
+    ``postings_gc`` trigger.
+    """
+
+    db.execute("DELETE FROM postings WHERE path = ?", (fn,))
+
+
+def trigrams_of(s):
+    """Returns the set of trigrams of the string ``s``.
+    """
+
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def index_del(fn):
+    """Removes ``fn`` from the index.
+
+    Returns:
+        bool: False if the index is busy, see ``index_warn``.
+
+    """
+
+    if _memo is not None:
+        _memo.pop(os.path.abspath(fn), None)
+
+    with _index_lock:
+        try:
+            for table in ("tags", "hashes", "unposted"):
+                index_execute("DELETE FROM {0} WHERE path = ?".format(table),
+                              (os.path.abspath(fn),))
+            if _index is not None:
+                index_unpost(_index, os.path.abspath(fn))
+        except sqlite3.OperationalError as err:
+            index_warn(err)
+            return False
+
+        index_written()
+
+    return True
+
+
+def index_move(src, dest):
+    """Moves the index entry of ``src`` to ``dest``.
+    """
+
+    src = os.path.abspath(src)
+    dest = os.path.abspath(dest)
+
+    if _memo is not None and src in _memo:
+        _memo[dest] = _memo.pop(src)
+
+    with _index_lock:
+        try:
+            _index_move(src, dest)
+        except sqlite3.OperationalError as err:
+            index_warn(err)
+        else:
+            index_written()
+
+
+def _index_move(src, dest):
+    """Moves the index entry, see ``index_move``.
+    """
+
+    rows = index_execute("SELECT size, mtime, tags FROM tags "
+                         "WHERE path = ?", (src,))
+
+    if not rows:
+        return
+
+    tags = json.loads(rows[0][2])
+    tags["path"] = [dest]
+    index_execute("DELETE FROM tags WHERE path = ?", (src,))
+    index_execute("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)",
+                  (dest, rows[0][0], rows[0][1], json.dumps(tags)))
+    index_execute("UPDATE OR REPLACE hashes SET path = ? WHERE path = ?",
+                  (dest, src))
+    index_unpost(_index, dest)
+    index_execute("UPDATE postings SET path = ? WHERE path = ?",
+                  (dest, src))
+    index_execute("UPDATE OR REPLACE unposted SET path = ? "
+                  "WHERE path = ?", (dest, src))
+
+
+def index_del_tree(d):
+    """Removes all files below the directorie ``d`` from the index.
+    """
+
+    d = os.path.join(os.path.abspath(d), "")
+    end = d[:-1] + chr(ord(os.sep) + 1)
+
+    if _memo is not None:
+        for fn in [fn for fn in _memo if fn.startswith(d)]:
+            del _memo[fn]
+
+    with _index_lock:
+        try:
+            for table in ("tags", "hashes", "postings", "unposted"):
+                index_execute("DELETE FROM {0} WHERE path >= ? "
+                              "AND path < ?".format(table), (d, end))
+        except sqlite3.OperationalError as err:
+            index_warn(err)
+        else:
+            index_written()
+
+
+def index_walk(ls, recursiv=False):
+    """Yields indexed files instead of walking the filesystem.
+
+    Args:
+        ls: An iterable of files/directories.
+        recursiv: Find files recursivly.  ``bool``
+
+    Yields:
+        str: An absolute filename from the index.
+
+    """
+
+    for fd in ls:
+        fd = os.path.abspath(fd)
+        rows = index_execute("SELECT path FROM tags WHERE path = ?", (fd,))
+
+        if rows is None:
+            return
+
+        if recursiv:
+            d = os.path.join(fd, "")
+            rows += index_execute(
+                "SELECT path FROM tags WHERE path >= ? AND path < ? "
+                "ORDER BY path", (d, d[:-1] + chr(ord(os.sep) + 1)))
+
+        for row in rows:
+            yield row[0]
+
+
+def index_lookup(fn, props=True):
+    """Looks up ``fn`` in the index.
+
+    Args:
+        fn: A filename.
+        props: Entries without audio properties count as stale.  ``bool``
+
+    Returns:
+        tuple: The ``os.stat_result`` of ``fn`` or None if it can't be
+            stated, and the indexed tags or None if they are stale.
+
+    """
+
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None, None
+
+    try:
+        tags = index_get(os.path.abspath(fn), st)
+    except sqlite3.OperationalError as err:
+        index_warn(err)
+        tags = None
+
+    if tags is None:
+        return st, None
+
+    if props and PROPS[0] not in tags:
+        return st, None
+
+    tags["path"] = [fn]
+    if not props:
+        strip_props(tags)
+
+    return st, tags
+
+
+def load_tags(fn, props=True):
+    """Reads tags from an audio file through the index.
+
+    The file is only parsed if it is not in the index or its size or mtime
+    has changed since it was indexed.
+
+    Args:
+        fn: A filename.
+        props: Include the audio properties (``PROPS``).  ``bool``
+
+    Returns:
+        dict: A dictinary with the tag, value pairs.
+
+    """
+
+    with phase("index", fn):
+        st, tags = index_lookup(fn, props=props)
+
+    if st is None:
+        return {}
+
+    if tags is None:
+        tags = read_tags(fn, props=props)
+        if tags:
+            index_put(fn, tags, st)
+
+    return tags
+
+
+def batched(iterable, n):
+    """Yields lists of ``n`` items from ``iterable``.
+    """
+
+    it = iter(iterable)
+    batch = list(itertools.islice(it, n))
+
+    while batch:
+        yield batch
+        batch = list(itertools.islice(it, n))
+
+
+def iter_tags(ls, jobs=1, chunksize=64, props=True):
+    """Yields the tags of the files in ``ls`` in the same order.
+
+    With more than one job, files which are missing in the index are parsed
+    by a pool of ``jobs`` processes, ``chunksize`` files per task.  Otherwise
+    files are read through ``aio_map`` if ``--aio`` is set.
+
+    Args:
+        ls: An iterable of filenames.
+        jobs: The number of worker processes.  ``int``
+        chunksize: The number of files per worker task.  ``int``
+        props: Include the audio properties (``PROPS``).  ``bool``
+
+    Yields:
+        tuple: The filename and its tags like ``load_tags`` returns them.
+
+    """
+
+    if jobs <= 1 and AIO:
+        yield from aio_map(functools.partial(load_tags, props=props), ls)
+        return
+
+    if jobs <= 1:
+        for fn in ls:
+            yield fn, load_tags(fn, props=props)
+        return
+
+    import multiprocessing
+
+    read = functools.partial(read_tags, props=props)
+
+    with multiprocessing.Pool(jobs) as pool:
+        for batch in batched(ls, jobs * chunksize):
+            retval = []
+            todo = []
+
+            for fn in batch:
+                st, tags = index_lookup(fn, props=props)
+                if st is not None and tags is None:
+                    todo.append((len(retval), st))
+                retval.append(tags or {})
+
+            fns = [batch[i] for i, _ in todo]
+            with phase("parse"):
+                for (i, st), tags in zip(todo, pool.imap(read, fns,
+                                                         chunksize)):
+                    if tags:
+                        index_put(batch[i], tags, st)
+                    retval[i] = tags
+
+            for fn, tags in zip(batch, retval):
+                yield fn, tags
+
+
+def save_file(fn, af):
+    """Saves and closes an open ``taglib.File`` and updates the index.
+    """
+
+    tags = file_tags(af)
+    with phase("save", fn):
+        failed = af.save()
+        af.close()
+
+    if STATS is not None:
+        STATS.bytes_written += os.path.getsize(fn)
+
+    if failed:
+        index_del(fn)
+    else:
+        index_put(fn, tags)
+
+
+class TagSummary(object):
+    """A streaming summary of the values of one tag.
+
+    Keeps the first value, the number of files with the tag and, if ``k`` is
+    set, the ``k`` most frequent values.  The top values are counted with the
+    space-saving algorithm, so the memory per tag stays constant however many
+    distinct values there are.  The counts are exact as long as a tag has no
+    more than ``k`` distinct values, beyond that the counts of values which
+    replaced another one are estimates, upper bounds of the real count.
+    """
+
+    __slots__ = ("first", "files", "mixed", "k", "counts")
+
+    def __init__(self, value, k=0):
+        self.first = value
+        self.files = 0
+        self.mixed = False
+        self.k = k
+        self.counts = {}
+
+    def add(self, value):
+        """Counts one file with the tag value ``value``.
+        """
+
+        self.files += 1
+
+        if value != self.first:
+            self.mixed = True
+
+        if not self.k:
+            return
+
+        # value: [count, error]
+        if value in self.counts:
+            self.counts[value][0] += 1
+        elif len(self.counts) < self.k:
+            self.counts[value] = [1, 0]
+        else:
+            least = min(self.counts, key=lambda v: self.counts[v][0])
+            c = self.counts.pop(least)[0]
+            self.counts[value] = [c + 1, c]
+
+    def top(self):
+        """Returns the counted values, the most frequent first.
+
+        Returns:
+            list: A list of ``(value, count, exact)`` tuples, ``exact`` is
+                False if ``count`` is an estimate.
+
+        """
+
+        retval = [(v, c, not e) for v, (c, e) in self.counts.items()]
+        return sorted(retval, key=lambda i: (-i[1], i[0]))
+
+
+def summarize_tags(ls, jobs=1, props=True, topk=0):
+    """Summarizes the tags of all files in a single pass.
+
+    Args:
+        ls: An iterable of filenames.
+        jobs: The number of processes reading tags.
+        props: Include the audio properties (``PROPS``).  ``bool``
+        topk: The number of most frequent values to keep per tag.  ``int``
+
+    Returns:
+        tuple: The number of files and a dict of ``TagSummary`` per tag.
+
+    """
+
+    if isinstance(ls, str) or not hasattr(ls, "__iter__"):
+        raise TypeError("``ls`` is not an iterable of filenames")
+
+    return summarize_records((tags for _, tags in
+                              iter_tags(ls, jobs=jobs, props=props)),
+                             topk=topk)
+
+
+def summarize_records(records, topk=0):
+    """Summarizes an iterable of tag dicts, see ``summarize_tags``.
+    """
+
+    summaries = {}
+    n = 0
+
+    for tags in records:
+        n += 1
+        for tag, values in tags.items():
+            value = tuple(values)
+            if tag not in summaries:
+                summaries[tag] = TagSummary(value, k=topk)
+            summaries[tag].add(value)
+
+    return n, summaries
+
+
+def merge_summaries(n, summaries):
+    """Merges tag summaries to a dict like ``merge_tags`` returns it.
+    """
+
+    retval = {}
+
+    for tag, summary in summaries.items():
+        if summary.mixed or summary.files != n:
+            retval[tag] = ["~"]
+        else:
+            retval[tag] = list(summary.first)
+
+    return retval
+
+
+def merge_tags(ls, jobs=1, props=True):
+    """Merges all tags together in one dict.  Tags with different values or
+    which are missing in some files get the value ``~``.
+
+    Args:
+        ls: An iterable of filenames.
+        jobs: The number of processes reading tags.
+        props: Include the audio properties (``PROPS``).  ``bool``
+
+    """
+
+    return merge_summaries(*summarize_tags(ls, jobs=jobs, props=props))
+
+
+def print_tags(tags, summaries=None):
+    """Prints tags to stdout.  For mixed tags the most frequent values of
+    ``summaries`` are printed as well, estimated counts with a leading ``~``.
+    """
+    l = 0
+    for k in tags.keys():
+        if len(k) > l:
+            l = len(k)
+
+    s = ""
+    for tag in sorted(tags):
+        s += "{0:{1}}: `{2}`".format(tag.lower(), l+1, "`, `".join(tags[tag]))
+        if summaries and summaries[tag].k and tags[tag] == ["~"]:
+            s += " " + ", ".join("`{0}` ({1}{2})".format(
+                ", ".join(v), "" if exact else "~", c)
+                for v, c, exact in summaries[tag].top())
+        s += "\n"
+    print(s)
+
+
+def tc_list(argv):
+    """
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [list|ls]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--no-props", dest="props", action="store_false")
+    parser.add_argument("-I", "--indexed", action="store_true")
+    parser.add_argument("-k", "--top", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.indexed:
+        files = index_walk(args.files, recursiv=args.recursiv)
+    else:
+        files = iwalk(args.files, recursiv=args.recursiv, test=isaudio)
+    n, summaries = summarize_tags(files, jobs=args.jobs, props=args.props,
+                                  topk=args.top)
+    print_tags(merge_summaries(n, summaries), summaries)
+
+
+def tc_write(argv):
+    """Parses arguments from commandline and runs write_tags.
+    """
+    parser = argparse.ArgumentParser(prog="tagcat [write|wr]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+    parser.add_argument("-a", "--artist")
+    parser.add_argument("-aa", "--albumartist")
+    parser.add_argument("-A", "--album")
+    parser.add_argument("-t", "--title")
+    parser.add_argument("-n", "--tracknumber")
+    parser.add_argument("-l", "--label")
+    parser.add_argument("-d", "--date")
+    parser.add_argument("-b", "--bpm")
+    # parser.add_argument("-c", "--catalognumber")
+    parser.add_argument("-g", "--genre")
+    parser.add_argument("-s", "--style")
+    parser.add_argument("-c", "--comment")
+
+    tags = vars(parser.parse_args(argv))
+
+    recursiv = tags.pop("recursiv")
+    files = filewalk(tags.pop("files"), recursiv=recursiv, test=isaudio)
+
+    print_summary(write_tags(files, tags))
+
+
+def apply_ops(tags, ops, verbose=True):
+    """Applies mutation operations to a tag dict in place.
+
+    An operation is a tuple with the name of the operation first:
+
+    - ``("set", TAG, [VALUE, ...])`` sets the values of ``TAG``
+    - ``("del", TAG)`` deletes ``TAG``
+    - ``("cleanup",)`` keeps the first stripped value of ``CLEANTAGS`` and
+      deletes all other tags
+    - ``("wipe",)`` deletes all tags
+    - ``("replace", {TAG: [VALUE, ...]})`` replaces all tags
+
+    Args:
+        tags: A dict with the tag, value pairs.
+        ops: A list of operations.
+        verbose: Print the tags deleted by ``cleanup``.  ``bool``
+
+    Raises:
+        ValueError: If an operation is unknown.
+
+    """
+
+    for op in ops:
+        if op[0] == "set":
+            tags[op[1]] = list(op[2])
+
+        elif op[0] == "del":
+            if op[1] in tags:
+                del tags[op[1]]
+
+        elif op[0] == "cleanup":
+            for t in list(tags.keys()):
+                if t in CLEANTAGS:
+                    tags[t] = [tags[t][:1][0].strip()]
+                else:
+                    if verbose:
+                        print("deleting '{0}': '{1}'".format(t, tags[t]))
+                    del tags[t]
+
+        elif op[0] == "wipe":
+            tags.clear()
+
+        elif op[0] == "replace":
+            tags.clear()
+            tags.update((t, list(v)) for t, v in op[1].items())
+
+        else:
+            raise ValueError("unknown operation `{0}`".format(op[0]))
+
+
+def mutate_file(fn, ops, dry=False, verbose=True):
+    """Opens ``fn`` once, applies all ``ops`` and saves it once.  The file is
+    not saved if the operations don't change its tags.
+
+    Returns:
+        bool: True if the tags of ``fn`` have changed, False otherwise.
+
+    """
+
+    with phase("parse", fn):
+        af = taglib.File(fn)
+
+    if STATS is not None:
+        STATS.bytes_read += os.path.getsize(fn)
+
+    with phase("mutate", fn):
+        before = {t: list(v) for t, v in af.tags.items()}
+        apply_ops(af.tags, ops, verbose=verbose)
+        touched = af.tags != before
+
+    if any(op[0] == "wipe" for op in ops) and af.unsupported:
+        af.removeUnsupportedProperties(af.unsupported)  # not sure
+        touched = True
+
+    if dry or not touched:
+        af.close()
+    else:
+        save_file(fn, af)
+
+    return touched
+
+
+def mutate(ls, ops, dry=False, verbose=True):
+    """Applies mutation operations to audiofiles, one save per file.
+
+    Args:
+        ls: A list of filenames.
+        ops: A list of operations, see ``apply_ops``.
+        dry: Don't save the files.
+        verbose: Print the tags deleted by ``cleanup``.  ``bool``
+
+    Returns:
+        tuple: The number of touched and of skipped files.
+
+    Raises:
+        TypeError: If ``ls`` is not a list.
+
+    """
+
+    if not isinstance(ls, list):
+        raise TypeError("``ls`` is not an instance of ``list``")
+
+    func = functools.partial(mutate_file, ops=ops, dry=dry, verbose=verbose)
+    todo = [fn for fn in ls if not journaled("tag", fn)]
+
+    if AIO:
+        results = aio_map(func, todo)
+    else:
+        results = ((fn, func(fn)) for fn in todo)
+
+    touched = 0
+    for fn, changed in results:
+        if changed:
+            touched += 1
+        if not dry:
+            journal("tag", fn)
+
+    return touched, len(ls) - touched
+
+
+def print_summary(counts):
+    """Prints the number of touched and skipped files.
+    """
+
+    print("{0} touched, {1} skipped".format(*counts))
+
+
+class OpAction(argparse.Action):
+    """Collects mutation operations in the order of the command line.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        ops = list(getattr(namespace, self.dest) or [])
+
+        if self.const == "set":
+            t, sep, v = values.partition("=")
+            if not sep:
+                parser.error("{0} expects TAG=VALUE".format(option_string))
+            ops.append(("set", t.upper(), [v]))
+
+        elif self.const == "del":
+            ops.extend(("del", t.upper()) for t in values)
+
+        else:
+            ops.append((self.const,))
+
+        setattr(namespace, self.dest, ops)
+
+
+def tc_edit(argv):
+    """Parses cmd arguments and runs all given operations in one pass.
+
+    Usage:
+        tagcat edit -r --set genre=X --del comment --cleanup -- testfiles/
+
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [edit|ed]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+    parser.add_argument("-d", "--dry", action="store_true")
+    parser.add_argument("--set", dest="ops", action=OpAction, const="set",
+                        metavar="TAG=VALUE")
+    parser.add_argument("--del", dest="ops", action=OpAction, const="del",
+                        metavar="TAG", nargs="+")
+    parser.add_argument("--cleanup", dest="ops", action=OpAction,
+                        const="cleanup", nargs=0)
+    parser.add_argument("--wipe", dest="ops", action=OpAction, const="wipe",
+                        nargs=0)
+
+    args = parser.parse_args(argv)
+
+    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
+    print_summary(mutate(filelist, args.ops or [], dry=args.dry))
+
+
+def write_tags(ls, tags):
+    """Writes tags to an audiofile.
+    """
+
+    return mutate(ls, [("set", t.upper(), [v])
+                       for t, v in tags.items() if v])
+
+
+def del_tags(ls, tags):
+    """Deletes tags form audiofiles.
+    """
+
+    return mutate(ls, [("del", t.upper()) for t in tags])
+
+
+def tc_delete(argv):
+    """Parses cmd arguments and runs del_tags()
+
+    Usage:
+        tagcat delete -r -t artist album -- testfiles/
+
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [delete|del]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+    parser.add_argument("-t", "--tags", dest="tags", nargs="+")
+
+    args = parser.parse_args(argv)
+
+    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
+    print_summary(del_tags(filelist, args.tags))
+
+
+def wipeout_tags(ls):
+    """Removes all tags from audiofiles.
+    """
+
+    if not isinstance(ls, list):
+        raise TypeError("``ls`` is not an instance of ``list``")
+
+    return mutate(ls, [("wipe",)])
+
+
+def tc_wipeout(argv):
+    """Parses cmd arguments and run wipeout_tags.
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [wipeout|wo]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+
+    args = parser.parse_args(argv)
+
+    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
+    print_summary(wipeout_tags(filelist))
+
+
+def clear_tags(ls, dry=False):
+    """Removes all multiply tag values and strip whitspaces from the first.
+    """
+
+    if not isinstance(ls, list):
+        raise TypeError
+
+    if len(ls) == 0:
+        raise ValueError
+
+    return mutate(ls, [("cleanup",)], dry=dry)
+
+
+def tc_clear(argv):
+    """
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [clear|cl]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+    parser.add_argument("-d", "--dry", action="store_true")
+
+    args = parser.parse_args(argv)
+
+    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
+    print_summary(clear_tags(filelist, dry=args.dry))
+
+
+NONASCII = re.compile(r"[^a-z0-9_\.\ \(\)&]")
+WHITESPACES = re.compile(r"\s+")
+UNICODETABLE = str.maketrans({ord("ß"): "sz",
+                              # a
+                              ord("ä"): "ae",
+                              ord("æ"): "ae",
+                              ord("à"): "a",
+                              ord("á"): "a",
+                              ord("â"): "a",
+                              ord("ã"): "a",
+                              ord("å"): "a",
+                              # e
+                              ord("è"): "e",
+                              ord("é"): "e",
+                              ord("ê"): "e",
+                              ord("ë"): "e",
+                              # i
+                              ord("ì"): "i",
+                              ord("í"): "i",
+                              ord("î"): "i",
+                              ord("ï"): "i",
+                              # n
+                              ord("ñ"): "n",
+                              ord("ņ"): "n",
+                              ord("ň"): "n",
+                              ord("ŉ"): "n",
+                              ord("ŋ"): "n",
+                              # o
+                              ord("ö"): "oe",
+                              ord("ò"): "o",
+                              ord("ó"): "o",
+                              ord("ô"): "o",
+                              ord("õ"): "o",
+                              ord("ø"): "o",
+                              ord("õ"): "o",
+                              ord("ō"): "o",
+                              ord("ő"): "o",
+                              ord("ǒ"): "o",
+                              ord("ȱ"): "o",
+                              # r
+                              ord("ŕ"): "r",
+                              ord("ŗ"): "r",
+                              ord("ř"): "r",
+                              # s
+                              ord("ś"): "s",
+                              ord("ŝ"): "s",
+                              ord("ş"): "s",
+                              ord("š"): "s",
+                              ord("ś"): "s",
+                              # c
+                              ord("ć"): "c",
+                              ord("ĉ"): "c",
+                              ord("ċ"): "c",
+                              ord("č"): "c",
+                              # u
+                              ord("ü"): "ue",
+                              ord("ù"): "u",
+                              ord("ú"): "u",
+                              ord("û"): "u",
+                              ord("ů"): "u",
+                              ord("ũ"): "u",
+                              ord("ũ"): "u",
+                              ord("ŭ"): "u",
+                              ord("ű"): "u",
+                              ord("ų"): "u",
+                              })
+
+
+def tagval_mutation(tag):
+    """Mutates the tag value to an filesystem friendly version.
+
+    1. translate to lowercase
+    2. translate unicode chrs to ascii chrs
+    3. remove all unwanted/unknown chrs
+    4. strip whitespaces
+    5. remove double whitespaces
+    6. replaces whitespaces whit underscores
+
+    """
+
+    # (0) we only use the first value
+    return sanitize(tag[0])
+
+
+@functools.lru_cache(maxsize=65536)
+def sanitize(s):
+    """Does the work of ``tagval_mutation`` for a single string.  Results are
+    memoized, artist and album names repeat a lot.
+    """
+
+    # (1) translate to lowercase
+    s = s.lower()
+    # (2) translate unicode chrs
+    s = s.translate(UNICODETABLE)
+    # (3)
+    s = NONASCII.sub("", s)
+    # (4) strip whitespaces
+    s = s.strip()
+    # (5 + 6) remove/replace whitspaces (6., 7.)
+    s = WHITESPACES.sub("_", s)
+
+    return s
+
+
+def translate_unicode(string):
+    """Translate a string to ascii character only (hopefully).
+
+    Args:
+        string: A string to substitute.
+
+    returns:
+        string: A string whitout any non ascii characters.
+
+    """
+
+    return string.translate(UNICODETABLE)
+
+
+def samedir(ls):
+    """Test if all files are in the same directorie.
+
+    Args:
+        fl: A list of absolute filenames.
+
+    Returns:
+        bool
+
+    Raises:
+        ...
+
+    """
+
+    if not isinstance(ls, list):
+        raise TypeError
+
+    if len(ls) == 0:
+        raise ValueError
+
+    def recursion(index):
+
+        if index == len(ls) or len(ls) == 1:
+            return True
+
+        if os.path.dirname(ls[index]) != os.path.dirname(ls[0]):
+            return False
+
+        return recursion(index+1)
+
+    return recursion(1)
+
+
+def has_coretags(tags):
+    """Test if the file contain all core tags.
+
+    Args:
+        fh: A taglib.File instance.
+
+    Returns:
+        bool: Wether the file has all core tags or not.
+
+    Raises:
+        ...
+
+    """
+
+    if not isinstance(tags, dict):
+        raise TypeError
+
+    if all(k in tags for k in ("ARTIST",
+                               "ALBUMARTIST",
+                               "ALBUM",
+                               "TITLE",
+                               "TRACKNUMBER")):
+        return True
+
+    return False
+
+
+FIELD = re.compile(r"\{([^{}:]+)(?::([^{}]*))?\}")
+
+
+@functools.lru_cache(maxsize=32)
+def compile_template(template):
+    """Compiles a filename template into a function.
+
+    The template is relative to ``BASEDIR`` and without the file extension,
+    ``/`` separates directories.
+
+    - ``{tag}`` is the first value of ``tag`` passed through
+      ``tagval_mutation``
+    - ``{tag:02d}`` is the number before an optional ``/`` in the first
+      value of ``tag``, formatted with the given format spec
+    - ``{tag|other}`` falls back to ``other`` if ``tag`` is missing or empty
+    - ``[...]`` is left out if a tag inside is missing
+
+    Example:
+        ``{albumartist|artist}/{album}/[{discnumber:d}-]{tracknumber:02d}``
+
+    Returns:
+        func: A function mapping a tag dict to a path.  It raises
+            ``KeyError`` with the tag name if a required tag is missing.
+
+    Raises:
+        ValueError: If the brackets of ``template`` are unbalanced.
+
+    """
+
+    def parse(i, depth):
+        parts = []
+        lit = ""
+
+        while i < len(template):
+            c = template[i]
+
+            if c in "[]{":
+                if lit:
+                    parts.append(_literal(lit))
+                    lit = ""
+
+            if c == "[":
+                sub, i = parse(i+1, depth+1)
+                parts.append(_optional(sub))
+            elif c == "]":
+                if not depth:
+                    raise ValueError("unbalanced `]` in template")
+                return parts, i+1
+            elif c == "{":
+                m = FIELD.match(template, i)
+                if not m:
+                    raise ValueError("bad field at {0} in template".format(i))
+                parts.append(_field(m.group(1).split("|"), m.group(2)))
+                i = m.end()
+            else:
+                lit += c
+                i += 1
+
+        if depth:
+            raise ValueError("unbalanced `[` in template")
+
+        if lit:
+            parts.append(_literal(lit))
+
+        return parts, i
+
+    parts = parse(0, 0)[0]
+
+    def render(tags):
+        return "".join([p(tags) for p in parts])
+
+    return render
+
+
+def _literal(s):
+    """Template part for literal text.
+    """
+
+    return lambda tags: s
+
+
+def _optional(parts):
+    """Template part for ``[...]``.
+    """
+
+    def optional(tags):
+        try:
+            return "".join([p(tags) for p in parts])
+        except KeyError:
+            return ""
+
+    return optional
+
+
+def _field(names, spec):
+    """Template part for ``{tag|fallback:spec}``.
+    """
+
+    names = [n.strip().upper() for n in names]
+
+    def field(tags):
+        for n in names:
+            if tags.get(n) and tags[n][0].strip():
+                if spec:
+                    return format(int(tags[n][0].split("/")[0]), spec)
+                return tagval_mutation(tags[n])
+
+        raise KeyError(names[0])
+
+    return field
+
+
+def gen_filename(fn, template=None, tags=None):
+    """Generates the file name based on the tag data.
+
+    Args:
+        fn: A filename.
+        template: A template, see ``compile_template``.  Defaults to
+            ``TEMPLATE``.
+        tags: The tags of ``fn``, read from the index if not given.
+
+    Raises:
+        ValueError: If ``fn`` misses a tag which the template needs.
+
+    """
+
+    if not isinstance(fn, str):
+        raise TypeError
+
+    if tags is None:
+        tags = load_tags(fn, props=False)
+
+    try:
+        path = compile_template(template or TEMPLATE)(tags)
+    except KeyError as err:
+        raise ValueError("`{0}` need coretags ({1})".format(fn, err.args[0]))
+
+    ending = os.path.splitext(fn)[1]
+
+    return os.path.normpath(os.path.join(BASEDIR, path + ending))
+
+
+def plan_rename(ls, template=None, tags=None):
+    """Computes the destinations of all files before anything is moved.
+
+    Args:
+        ls: A list of filenames.
+        template: A template, see ``compile_template``.
+        tags: A list with the tags of each file, read if not given.
+
+    Returns:
+        list: A list of ``(source, destination)`` tuples.
+
+    Raises:
+        TypeError: If ``ls`` is not a list.
+        FileExistsError: If a destination exists already or if more than one
+            file would be moved to the same destination.
+
+    """
+
+    if not isinstance(ls, list):
+        raise TypeError
+
+    if tags is None:
+        tags = [None] * len(ls)
+
+    plan = [(fn, gen_filename(fn, template, t)) for fn, t in zip(ls, tags)]
+
+    # list every destination directorie only once
+    existing = {}
+    for d in set(os.path.dirname(dest) for _, dest in plan):
+        try:
+            existing[d] = set(os.listdir(d))
+        except OSError:
+            existing[d] = set()
+
+    collisions = []
+    sources = {}
+
+    for fn, dest in plan:
+        if dest in sources:
+            collisions.append("`{0}` and `{1}` > `{2}`".format(sources[dest],
+                                                              fn, dest))
+        elif dest != os.path.abspath(fn) and \
+                os.path.basename(dest) in existing[os.path.dirname(dest)]:
+            collisions.append("`{0}` > `{1}` exists".format(fn, dest))
+        sources[dest] = fn
+
+    if collisions:
+        raise FileExistsError("\n".join(collisions))
+
+    return plan
+
+
+def print_plan(plan):
+    """Prints a rename plan to stdout.
+    """
+
+    for fn, dest in plan:
+        print(fn, " > ", dest)
+
+
+def apply_rename(plan, jobs=4):
+    """Moves all files of a rename plan.  Each destination directorie is
+    created once.
+    """
+
+    for d in sorted(set(os.path.dirname(dest) for _, dest in plan)):
+        os.makedirs(d, exist_ok=True)
+
+    move_files([(fn, dest) for fn, dest in plan
+                if os.path.abspath(fn) != dest], jobs=jobs)
+
+
+def copy_file(src, dest):
+    """Copies ``src`` to ``dest`` inside the kernel and keeps the mode and
+    the mtime of ``src``.  Uses ``os.copy_file_range`` and falls back to
+    ``os.sendfile`` and then to a plain read/write copy.
+    """
+
+    st = os.stat(src)
+
+    try:
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+            for copy in (_copy_range, _copy_sendfile):
+                try:
+                    copy(fsrc.fileno(), fdst.fileno(), st.st_size)
+                    break
+                except (AttributeError, OSError):
+                    fdst.seek(0)
+                    fdst.truncate()
+            else:
+                fsrc.seek(0)
+                shutil.copyfileobj(fsrc, fdst)
+
+        os.chmod(dest, stat.S_IMODE(st.st_mode))
+        os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+    except BaseException:
+        if os.path.exists(dest):
+            os.unlink(dest)
+        raise
+
+
+def _copy_range(fdin, fdout, size):
+    """Copies ``size`` bytes with ``os.copy_file_range``.
+    """
+
+    offset = 0
+    while offset < size:
+        n = os.copy_file_range(fdin, fdout, size - offset, offset, offset)
+        if n == 0:
+            raise OSError(errno.EIO, "short copy")
+        offset += n
+
+
+def _copy_sendfile(fdin, fdout, size):
+    """Copies ``size`` bytes with ``os.sendfile``.
+    """
+
+    offset = 0
+    while offset < size:
+        n = os.sendfile(fdout, fdin, offset, size - offset)
+        if n == 0:
+            raise OSError(errno.EIO, "short copy")
+        offset += n
+
+
+def fsync_path(fn):
+    """Flushes the file or directorie ``fn`` to disk.
+    """
+
+    fd = os.open(fn, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def move_files(moves, jobs=4):
+    """Moves files and keeps the index up to date.
+
+    Files on the same filesystem are renamed.  Files which would cross a
+    filesystem boundary are copied by ``jobs`` threads, every copy and its
+    directorie are fsynced and only then the sources are removed.  If a
+    copy fails, the finished copies are removed again before the error is
+    raised.
+
+    Args:
+        moves: A list of ``(source, destination)`` tuples.
+        jobs: The number of parallel copies.  ``int``
+
+    """
+
+    cross = []
+
+    for src, dest in moves:
+        if journaled("move", src):
+            continue
+
+        try:
+            with phase("move", src):
+                os.rename(src, dest)
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            cross.append((src, dest))
+        else:
+            index_move(src, dest)
+            journal("move", src)
+
+    if not cross:
+        return
+
+    with phase("copy"):
+        with concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) as ex:
+            copies = [ex.submit(copy_file, *m) for m in cross]
+            errors = [f.exception() for f in copies if f.exception()]
+
+            if not errors:
+                dests = [dest for _, dest in cross]
+                dests += sorted(set(os.path.dirname(d) for d in dests))
+                errors = [f.exception() for f in
+                          [ex.submit(fsync_path, d) for d in dests]
+                          if f.exception()]
+
+        if errors:
+            for (_, dest), f in zip(cross, copies):
+                if f.exception() is None and os.path.exists(dest):
+                    os.unlink(dest)
+            raise errors[0]
+
+    if STATS is not None:
+        STATS.bytes_written += sum(os.path.getsize(d) for _, d in cross)
+        STATS.files["copy"] += len(cross)
+
+    for src, dest in cross:
+        os.unlink(src)
+        index_move(src, dest)
+        journal("move", src)
+
+
+def rename(ls, dry=False, jobs=4, template=None):
+    """Renames an audiofile based on its tags.
+
+    Args:
+        ls: A list of filenames.
+        dry: Only print the plan.  ``bool``
+        jobs: The number of parallel copies across filesystems.  ``int``
+        template: A template, see ``compile_template``.
+
+    Returns:
+        list: The rename plan, see ``plan_rename``.
+
+    Raises:
+        ...
+
+    """
+
+    plan = plan_rename(ls, template=template)
+    print_plan(plan)
+
+    if not dry:
+        apply_rename(plan, jobs=jobs)
+
+    return plan
+
+
+def tc_rename(argv):
+    """
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [rename|ren]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+    parser.add_argument("-d", "--dry", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=4)
+    parser.add_argument("-T", "--template", default=TEMPLATE)
+    parser.add_argument("--plan-out", metavar="FILE")
+
+    args = parser.parse_args(argv)
+
+    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
+
+    if args.plan_out:
+        plan = rename(filelist, dry=True, template=args.template)
+        write_plan(args.plan_out, plan_entries(filelist, moves=plan))
+        return
+
+    rename(filelist, dry=args.dry, jobs=args.jobs, template=args.template)
+
+
+def plan_entries(files, ops=(), moves=(), mode=None):
+    """Builds the entries of a plan file.
+
+    Every entry holds the absolute ``path`` of a file with the ``size`` and
+    ``mtime`` it has now, and what to do with it: the ``mode`` to chmod
+    to, the tag ``ops`` (see ``apply_ops``) and the ``dest`` to move to.
+    Sources of ``moves`` which are not in ``files`` (like a cover) are
+    only moved.
+
+    Args:
+        files: A list of audio filenames.
+        ops: A list of operations for all ``files``.
+        moves: A list of ``(source, destination)`` tuples.
+        mode: The mode for all ``files`` or None.
+
+    Returns:
+        list: The plan entries.
+
+    """
+
+    dests = {os.path.abspath(src): dest for src, dest in moves}
+    audio = set(os.path.abspath(fn) for fn in files)
+    retval = []
+
+    for fn in itertools.chain(files, (src for src, _ in moves)):
+        fn = os.path.abspath(fn)
+        if fn not in audio and fn not in dests:
+            continue
+
+        st = os.stat(fn)
+        entry = {"path": fn, "size": st.st_size, "mtime": st.st_mtime_ns}
+
+        if fn in audio:
+            audio.discard(fn)
+            if mode is not None:
+                entry["mode"] = mode
+            if ops:
+                entry["ops"] = [list(op) for op in ops]
+
+        if dests.get(fn, fn) != fn:
+            entry["dest"] = dests[fn]
+        dests.pop(fn, None)
+
+        retval.append(entry)
+
+    return retval
+
+
+def write_plan(fn, entries):
+    """Writes plan entries as JSON to ``fn``.
+    """
+
+    plan = {"version": PLANVERSION, "entries": entries}
+
+    with open(fn, "w", encoding="utf-8") as fd:
+        json.dump(plan, fd, indent=1, ensure_ascii=False)
+        fd.write("\n")
+
+
+def read_plan(fn):
+    """Reads the entries of a plan file.
+
+    Raises:
+        ValueError: If ``fn`` is not a plan file of this version.
+
+    """
+
+    with open(fn, encoding="utf-8") as fd:
+        plan = json.load(fd)
+
+    if not isinstance(plan, dict) or plan.get("version") != PLANVERSION:
+        raise ValueError("`{0}` is not a plan file".format(fn))
+
+    return plan["entries"]
+
+
+def apply_plan(entries, dry=False, jobs=4):
+    """Executes plan entries without reading any tags for planning.
+
+    An entry is refused if its file has a different size or mtime than when
+    the plan was written, or if its destination exists.  All other entries
+    are chmoded, mutated with one save per file and moved together.
+
+    Returns:
+        tuple: The number of touched files, the list of moves and the list
+            of refused ``(filename, reason)`` tuples.
+
+    """
+
+    touched = 0
+    moves = []
+    refused = []
+
+    for e in entries:
+        fn = e["path"]
+
+        # resumed: the file was changed or moved by this plan already
+        if journaled("move", fn):
+            continue
+        if journaled("tag", fn):
+            if "dest" in e:
+                moves.append((fn, e["dest"]))
+            continue
+
+        try:
+            st = os.stat(fn)
+        except OSError as err:
+            refused.append((fn, err.strerror))
+            continue
+
+        if st.st_size != e["size"] or st.st_mtime_ns != e["mtime"]:
+            refused.append((fn, "changed"))
+            continue
+
+        if "dest" in e and os.path.exists(e["dest"]):
+            refused.append((fn, "destination exists"))
+            continue
+
+        if "mode" in e and not dry:
+            os.chmod(fn, e["mode"])
+
+        if e.get("ops") and mutate_file(fn, e["ops"], dry=dry, verbose=False):
+            touched += 1
+
+        if not dry:
+            journal("tag", fn)
+
+        if "dest" in e:
+            moves.append((fn, e["dest"]))
+
+    if moves and not dry:
+        apply_rename(moves, jobs=jobs)
+
+    return touched, moves, refused
+
+
+def tc_apply(argv):
+    """Executes a plan file written with ``--plan-out``.
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [apply|ap]")
+    parser.add_argument("plan", metavar="FILE")
+    parser.add_argument("-d", "--dry", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=4)
+
+    args = parser.parse_args(argv)
+
+    touched, moves, refused = apply_plan(read_plan(args.plan), dry=args.dry,
+                                         jobs=args.jobs)
+
+    print_plan(moves)
+    for fn, reason in refused:
+        print("refused ({0}): {1}".format(reason, fn))
+    print("{0} touched, {1} moved, {2} refused".format(
+        touched, len(moves), len(refused)))
+
+    if refused:
+        os.sys.exit(1)
+
+
+class Session(object):
+    """Loads the tags of a list of files once and keeps them in memory.
+
+    All stages of a command read and mutate the in-memory tags, kept in a
+    ``TagBatch``.  The operations are recorded and written with a single
+    save per file by ``flush``, renames are tracked so moved files are not
+    parsed again.
+    """
+
+    def __init__(self, ls, jobs=1):
+        self.batch = TagBatch()
+        self.ops = []
+
+        for fn, tags in iter_tags(list(ls), jobs=jobs):
+            self.batch.append(fn, tags)
+
+    @property
+    def files(self):
+        return self.batch.paths
+
+    def summarize(self, topk=0):
+        """Summarizes the tags, see ``summarize_tags``.
+        """
+
+        return self.batch.summarize(topk=topk)
+
+    def apply(self, ops, verbose=True):
+        """Applies mutation operations to the tags of all files.  The path
+        and the audio properties are no tags and stay untouched.
+        """
+
+        for i in range(len(self.batch)):
+            tags = self.batch[i]
+            kept = {t: tags.pop(t) for t in ("path",) + PROPS if t in tags}
+            apply_ops(tags, ops, verbose=verbose)
+            tags.update(kept)
+            self.batch[i] = tags
+
+        self.ops.extend(ops)
+
+    def plan_rename(self, template=None):
+        """Plans the renames from the in-memory tags, see ``plan_rename``.
+        """
+
+        return plan_rename(self.files, template, iter(self.batch))
+
+    def plan_cover(self, template=None):
+        """Plans the cover image move, see ``plan_cover``.
+        """
+
+        return plan_cover(self.files, template, self.batch[0])
+
+    def flush(self, dry=False):
+        """Writes the recorded operations, one save per changed file.
+
+        Returns:
+            tuple: The number of touched and of skipped files.
+
+        """
+
+        touched = 0
+
+        if self.ops:
+            for fn in self.files:
+                if journaled("tag", fn):
+                    continue
+                if mutate_file(fn, self.ops, dry=dry, verbose=False):
+                    touched += 1
+                if not dry:
+                    journal("tag", fn)
+
+        self.ops = []
+
+        return touched, len(self.files) - touched
+
+    def rename(self, plan, jobs=4):
+        """Applies a rename plan and keeps track of the new filenames.
+        """
+
+        apply_rename(plan, jobs=jobs)
+
+        moved = dict(plan)
+        self.batch.paths = [moved.get(fn, fn) for fn in self.files]
+
+
+def tc_auto(argv):
+    """
+    """
+
+    parser = argparse.ArgumentParser(prog="tagcat [auto|a]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-r", "--recursiv", action="store_true")
+    parser.add_argument("-d", "--dry", action="store_true")
+    parser.add_argument("-b", "--batch", action="store_true")
+    parser.add_argument("--rules", metavar="FILE")
+    parser.add_argument("-j", "--jobs", type=int, default=4)
+    parser.add_argument("--plan-out", metavar="FILE")
+
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        rules = load_rules(args.rules)
+        files = iwalk(args.files, recursiv=args.recursiv, test=isaudio)
+        reports = auto_batch(files, rules, dry=args.dry, jobs=args.jobs,
+                             plan=bool(args.plan_out))
+        if args.plan_out:
+            write_plan(args.plan_out, [e for r in reports
+                                       for e in r.pop("plan", [])])
+        print_reports(reports)
+        if any(r["status"] != "ok" for r in reports):
+            os.sys.exit(1)
+        return
+
+    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
+
+    # every file is parsed once, all stages work on the session
+    session = Session(filelist)
+
+    # list tags first
+    print_tags(merge_summaries(*session.summarize()))
+
+    if input("Exit: ") == "y":
+        os.sys.exit(2)
+
+    ops = []
+    if input("Set 'ALBUMARTIST': ") == "y":
+        aa = input("{0}: ".format("albumartist".upper()))
+        ops.append(("set", "ALBUMARTIST", [aa]))
+
+    # chmod
+    if not args.plan_out:
+        chmod(filelist)
+
+    # set albumartist and cleanup in memory
+    ops.append(("cleanup",))
+    session.apply(ops)
+
+    # cover
+    cover = session.plan_cover()
+    if cover:
+        print("{0} > {1}".format(*cover))
+
+    # rename
+    plan = session.plan_rename()
+    print_plan(plan)
+
+    # review now, apply later
+    if args.plan_out:
+        moves = plan + [cover] if cover else plan
+        write_plan(args.plan_out, plan_entries(filelist, ops, moves, 0o644))
+        return
+
+    answer = input("Rename: ")
+
+    # one save per file
+    print_summary(session.flush(dry=args.dry))
+
+    if answer != "y":
+        os.sys.exit(2)
+
+    if not args.dry:
+        if cover:
+            os.makedirs(os.path.dirname(cover[1]), exist_ok=True)
+            move_files([cover])
+        session.rename(plan)
+
+
+AUTORULES = {"albumartist": "no",
+             "missing_coretags": "skip",
+             "chmod": "yes",
+             "cleanup": "yes",
+             "cover": "yes",
+             "rename": "yes",
+             "template": TEMPLATE}
+
+
+def load_rules(fn=None):
+    """Reads the rules for ``auto --batch`` from the ``[auto]`` section of an
+    ini file.  Missing rules fall back to ``AUTORULES``.
+
+    Rules:
+        albumartist: ``uniform`` sets ALBUMARTIST to ARTIST when ARTIST is
+            the same in all files of an album, ``no`` leaves it.
+        missing_coretags: ``skip`` the album or ``exit`` the whole batch.
+        chmod, cleanup, cover, rename: ``yes`` or ``no``.
+        template: The filename template, see ``compile_template``.
+
+    Returns:
+        dict: The rules.
 
-        af.save()
-        af.close()
+    """
 
-        return recursion(index+1)
+    config = configparser.ConfigParser()
+    config.read_dict({"auto": AUTORULES})
 
-    return recursion(0)
+    if fn:
+        with open(fn, encoding="utf-8") as fd:
+            config.read_file(fd)
 
+    rules = dict(config["auto"])
+    for k in ("chmod", "cleanup", "cover", "rename"):
+        rules[k] = config["auto"].getboolean(k)
+
+    if rules["missing_coretags"] not in ("skip", "exit"):
+        raise ValueError("missing_coretags must be `skip` or `exit`")
+
+    return rules
+
+
+def group_albums(ls):
+    """Groups files by their directorie in one pass.
+
+    Returns:
+        dict: The lists of filenames per directorie, in walk order.
 
-def del_tags(ls, tags):
-    """Deletes tags form audiofiles.
     """
 
-    def recursion(index):
+    albums = collections.OrderedDict()
 
-        if index == len(ls):
-            return
+    for fn in ls:
+        albums.setdefault(os.path.dirname(os.path.abspath(fn)), []).append(fn)
 
-        af = taglib.File(ls[index])
-        for t in tags:
-            if t.upper() in af.tags:
-                del af.tags[t.upper()]
-        af.save()
-        af.close()
+    return albums
 
-        return recursion(index+1)
 
-    return recursion(0)
+def auto_album(files, rules, dry=False, plan=False, reserve=None):
+    """Runs the ``auto`` steps on one album without asking.
 
+    With ``plan`` nothing is changed, the steps are recorded as plan
+    entries instead, see ``plan_entries``.  The destinations are planned
+    before anything is changed and passed to ``reserve``, which raises
+    ``FileExistsError`` if another album claimed one of them.
 
-def tc_delete(argv):
-    """Parses cmd arguments and runs del_tags()
+    Returns:
+        dict: A report with the album ``dir``, the number of ``files``, the
+            ``status`` and the ``actions`` taken or the ``error``, and the
+            ``plan`` entries if ``plan`` is set.
 
-    Usage:
-        tagcat delete -r -t artist album -- testfiles/
+    """
+
+    report = {"dir": os.path.dirname(files[0]), "files": len(files),
+              "status": "ok", "actions": []}
+    tags = [load_tags(fn, props=False) for fn in files]
+    ops = []
+
+    if rules["albumartist"] == "uniform" and has_tags(tags, "ARTIST") and \
+            equal_tags(tags, "ARTIST"):
+        ops.append(("set", "ALBUMARTIST", tags[0]["ARTIST"]))
+
+    if rules["cleanup"]:
+        ops.append(("cleanup",))
+
+    # the tags like they will be after the mutation
+    for t in tags:
+        apply_ops(t, ops, verbose=False)
+
+    if not all(has_coretags(t) for t in tags):
+        report["status"] = "missing coretags"
+        return report
+
+    dry = dry or plan
+    moves = []
+
+    try:
+        cover = None
+        if rules["cover"]:
+            cover = plan_cover(files, rules["template"], tags[0])
+
+        if rules["rename"]:
+            moves = plan_rename(files, rules["template"], tags)
+
+        if reserve is not None:
+            dests = [dest for _, dest in moves]
+            reserve(dests + [cover[1]] if cover else dests)
+
+        if rules["chmod"] and not dry:
+            chmod(files)
+
+        if ops and plan:
+            report["actions"].append("{0} to tag".format(len(files)))
+        elif ops:
+            touched, _ = mutate(files, ops, dry=dry, verbose=False)
+            report["actions"].append("{0} tagged".format(touched))
+
+        if rules["rename"]:
+            if not dry:
+                apply_rename(moves)
+            report["actions"].append("{0} > {1}".format(
+                len(moves), os.path.dirname(moves[0][1])))
+
+        if cover:
+            if not dry:
+                os.makedirs(os.path.dirname(cover[1]), exist_ok=True)
+                move_files([cover])
+            moves.append(cover)
+            report["actions"].append("cover > {0}".format(cover[1]))
+
+        if plan:
+            report["plan"] = plan_entries(
+                files, ops, moves, 0o644 if rules["chmod"] else None)
+
+    except (OSError, ValueError) as err:
+        report["status"] = "failed"
+        report["error"] = str(err)
+
+    return report
+
+
+def auto_batch(ls, rules, dry=False, jobs=4, plan=False):
+    """Runs ``auto_album`` on every album directorie of ``ls`` with a pool of
+    ``jobs`` threads.
+
+    If an album misses coretags and the rule ``missing_coretags`` is
+    ``exit``, no further albums are started.
+
+    Returns:
+        list: A report per album, see ``auto_album``.
 
     """
 
-    parser = argparse.ArgumentParser(prog="tagcat [delete|del]")
-    parser.add_argument("files", metavar="FILE", nargs="+")
-    parser.add_argument("-r", "--recursiv", action="store_true")
-    parser.add_argument("-t", "--tags", dest="tags", nargs="+")
+    albums = group_albums(ls)
+    reports = []
+    stop = threading.Event()
+    reserved = set()
+    lock = threading.Lock()
 
-    args = parser.parse_args(argv)
+    def reserve(dests):
+        with lock:
+            taken = [d for d in dests if d in reserved]
+            if taken:
+                raise FileExistsError("\n".join(
+                    "`{0}` is planned by another album".format(d)
+                    for d in taken))
+            reserved.update(dests)
 
-    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
-    del_tags(filelist, args.tags)
+    def run(files):
+        if stop.is_set():
+            return {"dir": os.path.dirname(files[0]), "files": len(files),
+                    "status": "not started", "actions": []}
 
+        report = auto_album(files, rules, dry=dry, plan=plan,
+                            reserve=reserve)
+        if report["status"] == "missing coretags" and \
+                rules["missing_coretags"] == "exit":
+            stop.set()
 
-def wipeout_tags(ls):
-    """Removes all tags from audiofiles.
+        return report
+
+    with concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) as ex:
+        for report in ex.map(run, albums.values()):
+            reports.append(report)
+
+    return reports
+
+
+def print_reports(reports):
+    """Prints the reports of ``auto_batch``.
     """
 
-    if not isinstance(ls, list):
-        raise TypeError("``ls`` is not an instance of ``list``")
+    for r in reports:
+        details = r.get("error") or ", ".join(r["actions"])
+        print("{0:<16} {1} ({2} files) {3}".format(
+            r["status"], r["dir"], r["files"], details).rstrip())
 
-    if len(ls) == 0:
-        return
+    counts = collections.Counter(r["status"] for r in reports)
+    print(", ".join("{0} {1}".format(n, s) for s, n in sorted(counts.items())))
+
+
+def chmod(ls):
+    """
+    """
 
     def recursion(index):
 
         if index == len(ls):
-            return
+            return None
 
-        af = taglib.File(ls[index])
-        af.tags.clear()
-        af.removeUnsupportedProperties(af.unsupported)  # not sure
-        af.save()
-        af.close()
+        # do stuff
+        os.chmod(ls[index], mode=0o644)
 
+        # recursion
         return recursion(index+1)
 
     return recursion(0)
 
 
-def tc_wipeout(argv):
-    """Parses cmd arguments and run wipeout_tags.
+def equal_tags(ls, tag):
+    """Checks if `tag` is equal in all files.
     """
 
-    parser = argparse.ArgumentParser(prog="tagcat [wipeout|wo]")
-    parser.add_argument("files", metavar="FILE", nargs="+")
-    parser.add_argument("-r", "--recursiv", action="store_true")
+    if not isinstance(ls, list):
+        raise TypeError
 
-    args = parser.parse_args(argv)
+    if not len(ls):
+        raise ValueError
 
-    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
-    wipeout_tags(filelist)
+    def recursion(index):
 
+        if index == len(ls):
+            return True
 
-def clear_tags(ls, dry=False):
-    """Removes all multiply tag values and strip whitspaces from the first.
+        # do stuff
+        try:
+            if ls[0][tag] != ls[index][tag]:
+                raise KeyError
+        except KeyError:
+            return False
+
+        return recursion(index+1)
+
+    return recursion(1)
+
+
+def has_tags(ls, tag):
+    """
     """
 
     if not isinstance(ls, list):
         raise TypeError
 
-    if len(ls) == 0:
-        raise ValueError
+    if not len(ls):
+        raise ValueError("`ls` is empty")
 
     def recursion(index):
 
         if index == len(ls):
-            return
+            return True
 
-        af = taglib.File(ls[index])
-        for t in list(af.tags.keys()):
-            if t in CLEANTAGS:
-                af.tags[t] = [af.tags[t][:1][0].strip()]
-            else:
-                print("deleting '{0}': '{1}'".format(t, af.tags[t]))
-                del af.tags[t]
-        if not dry:
-            af.save()
-        af.close()
+        # do stuff
+        try:
+            if not ls[index][tag]:
+                raise KeyError
+        except KeyError:
+            return False
 
         return recursion(index+1)
 
     return recursion(0)
 
 
-def tc_clear(argv):
+def set_albumartist(ls):
     """
     """
+    aa = input("{0}: ".format("albumartist".upper()))
+    tags = {"ALBUMARTIST": aa}
+    write_tags(ls, tags)
 
-    parser = argparse.ArgumentParser(prog="tagcat [clear|cl]")
-    parser.add_argument("files", metavar="FILE", nargs="+")
-    parser.add_argument("-r", "--recursiv", action="store_true")
-    parser.add_argument("-d", "--dry", action="store_true")
 
-    args = parser.parse_args(argv)
+def plan_cover(ls, template=None, tags=None):
+    """Finds the cover image of an album and its destination.
 
-    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
-    clear_tags(filelist, dry=args.dry)
+    Args:
+        ls: A list of filenames living in the same directorie.
+        template: A template, see ``compile_template``.
+        tags: The tags of ``ls[0]``, read if not given.
 
+    Returns:
+        tuple: The image and its destination or None if there is not exactly
+            one jpg file.
 
-def tagval_mutation(tag):
-    """Mutates the tag value to an filesystem friendly version.
+    """
+
+    if not samedir(ls):
+        raise ValueError("Files must live in the same directorie")
+
+    jpgs = filewalk([os.path.dirname(ls[0])], recursiv=True, test=isjpg)
+
+    # todo: choose cover image
+    if len(jpgs) != 1:
+        return None
+
+    dest = os.path.dirname(gen_filename(ls[0], template, tags))
+
+    return jpgs[0], os.path.join(dest, "cover.jpg")
 
-    1. translate to lowercase
-    2. translate unicode chrs to ascii chrs
-    3. remove all unwanted/unknown chrs
-    4. strip whitespaces
-    5. remove double whitespaces
-    6. replaces whitespaces whit underscores
 
+def rename_cover(ls):
+    """
     """
 
-    # (0) we only use the first value
-    s = tag[0]
-    # (1) translate to lowercase
-    s = s.lower()
-    # (2) translate unicode chrs
-    s = translate_unicode(s)
-    # (3)
-    nonascii = re.compile(r"[^a-z0-9_\.\ \(\)&]")
-    s = nonascii.sub("", s)
-    # (4) strip whitespaces
-    s = s.strip()
-    # (5 + 6) remove/replace whitspaces (6., 7.)
-    whitespaces = re.compile(r"\s+")
-    s = whitespaces.sub("_", s)
+    cover = plan_cover(ls)
+
+    if cover:
+        jpg, dest = cover
+
+        if not os.path.exists(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+
+        print("{0} > {1}".format(jpg, dest))
+
+        move_files([(jpg, dest)])
+
+
+def grep_tags(ls, stags, regexp, jobs=1):
+    """Greps for files with a tag in ``stags`` matching ``regexp``.
+
+    Args:
+        ls: An iterable of filenames.
+        stags: A list of tagfields to search in.
+        regexp: The regular expression.
+        jobs: The number of processes reading tags.
+
+    Returns:
+        list: A list of filenames.
+
+    Raises:
+        TypeError: If `ls` is not an iterable
+
+    """
+
+    if isinstance(ls, str) or not hasattr(ls, "__iter__"):
+        raise TypeError
+
+    if not isinstance(stags, list):
+        raise TypeError("`stags` must be a list")
+
+    if not stags:
+        return []
+
+    node = functools.reduce(lambda a, b: ("or", a, b),
+                            [("re", query_tag(t), regexp) for t in stags])
+    retval = query_tags(ls, node, jobs=jobs)
+
+    for fn in retval:
+        print(fn)
+
+    return retval
+
+
+QUERYTOKEN = re.compile(r'\s*(\(|\)|(?:[^\s()"]|"[^"]*")+)')
+QUERYTERM = re.compile(r"(has|empty):(.+)|([^=~^]+)(=|\^=|~)(.*)", re.S)
+QUERYSCOPE = 32
+
+
+def parse_query(query):
+    """Parses a boolean tag query.
+
+    A query combines terms with ``AND`` (or just a space), ``OR``, ``NOT``
+    and parentheses.  A term is one of ``TAG=VALUE`` (equal), ``TAG^=VALUE``
+    (starts with), ``TAG~REGEXP`` (``re.match``), ``has:TAG`` or
+    ``empty:TAG`` (missing or empty).  Values are compared with the first
+    value of a tag in lowercase and may be quoted.
+
+    Returns:
+        tuple: The query tree.
+
+    Raises:
+        ValueError: If ``query`` is not a valid query.
+
+    """
+
+    tokens = QUERYTOKEN.findall(query)[::-1]
+    node = _parse_or(tokens)
+
+    if tokens:
+        raise ValueError("unexpected '{0}'".format(tokens[-1]))
+
+    return node
+
+
+def _parse_or(tokens):
+    node = _parse_and(tokens)
+
+    while tokens and tokens[-1] == "OR":
+        tokens.pop()
+        node = ("or", node, _parse_and(tokens))
+
+    return node
+
+
+def _parse_and(tokens):
+    node = _parse_not(tokens)
+
+    while tokens and tokens[-1] not in ("OR", ")"):
+        if tokens[-1] == "AND":
+            tokens.pop()
+        node = ("and", node, _parse_not(tokens))
+
+    return node
+
+
+def _parse_not(tokens):
+    if not tokens:
+        raise ValueError("unexpected end of query")
+
+    tok = tokens.pop()
+
+    if tok == "NOT":
+        return ("not", _parse_not(tokens))
+
+    if tok == "(":
+        node = _parse_or(tokens)
+        if not tokens or tokens.pop() != ")":
+            raise ValueError("missing ')'")
+        return node
+
+    m = QUERYTERM.fullmatch(tok)
+    if m is None:
+        raise ValueError("invalid term '{0}'".format(tok))
+
+    if m.group(1):
+        return (m.group(1), query_tag(m.group(2)))
+
+    op = {"=": "eq", "^=": "prefix", "~": "re"}[m.group(4)]
+    return (op, query_tag(m.group(3)), m.group(5).replace('"', ""))
+
+
+def query_tag(tag):
+    """Returns the tag name as it is stored, the audio properties are
+    lowercase.
+    """
+
+    return tag.lower() if tag.lower() in PROPS else tag.upper()
+
+
+@functools.lru_cache(maxsize=256)
+def query_regex(regexp):
+    return re.compile(regexp, re.I)
+
+
+def regex_literals(regexp):
+    """Returns lowercase substrings which every match of ``regexp`` contains.
+
+    The extraction is conservative: patterns with groups or alternatives
+    give no literals, and runs shorter than a trigram are dropped.  An
+    escaped letter or digit ends a run and adds nothing, together with the
+    hex digits, name or digits it consumes.
+    """
+
+    if "|" in regexp or "(" in regexp:
+        return []
+
+    runs = []
+    run = ""
+    i = 0
+
+    while i < len(regexp):
+        c = regexp[i]
+        i += 1
+
+        if c == "\\":
+            c = regexp[i:i + 1]
+            i += 1
+            if c and not c.isalnum():
+                run += c
+                continue
+            if c in "xuU":
+                i += {"x": 2, "u": 4, "U": 8}[c]
+            elif c == "N" and regexp[i:i + 1] == "{":
+                i = regexp.find("}", i) + 1 or len(regexp)
+            elif c.isdigit():
+                while regexp[i:i + 1].isdigit():
+                    i += 1
+        elif c in "?*{":
+            run = run[:-1]
+            if c == "{":
+                i = regexp.find("}", i) + 1 or len(regexp)
+        elif c == "[":
+            # a leading ``]`` belongs to the class
+            if regexp[i:i + 1] == "^":
+                i += 1
+            if regexp[i:i + 1] == "]":
+                i += 1
+            while i < len(regexp) and regexp[i] != "]":
+                i += 2 if regexp[i] == "\\" else 1
+            i += 1
+        elif c not in ".^$+":
+            run += c
+            continue
+
+        runs.append(run)
+        run = ""
+
+    runs.append(run)
+
+    return [r.lower() for r in runs if len(r) >= 3]
+
+
+def query_match(node, tags):
+    """Evaluates the query tree ``node`` on the tags of one file.
+    """
+
+    op = node[0]
+
+    if op == "and":
+        return query_match(node[1], tags) and query_match(node[2], tags)
+
+    if op == "or":
+        return query_match(node[1], tags) or query_match(node[2], tags)
+
+    if op == "not":
+        return not query_match(node[1], tags)
+
+    value = str(tags[node[1]][0]) if tags.get(node[1]) else None
+
+    if op == "has":
+        return value is not None
+
+    if op == "empty":
+        return not value
+
+    if value is None:
+        return False
+
+    if op == "eq":
+        return value.lower() == node[2].lower()
+
+    if op == "prefix":
+        return value.lower().startswith(node[2].lower())
+
+    return query_regex(node[2]).match(value.lower()) is not None
+
+
+def query_scope(ls, recursiv=False):
+    """Builds a SQL condition restricting ``path`` to the files/directories
+    in ``ls``.
+
+    Returns:
+        tuple: The condition and its parameters.
+
+    """
+
+    parts = []
+    params = []
+
+    for fd in ls:
+        fd = os.path.abspath(fd)
+        parts.append("path = ?")
+        params.append(fd)
+
+        if recursiv:
+            d = os.path.join(fd, "")
+            parts.append("(path >= ? AND path < ?)")
+            params.extend((d, d[:-1] + chr(ord(os.sep) + 1)))
 
-    return s
+    return "(" + " OR ".join(parts or ["0"]) + ")", params
 
 
-def translate_unicode(string):
-    """Translate a string to ascii character only (hopefully).
+def query_index(node, scope=("1", [])):
+    """Evaluates the query tree ``node`` against the postings of the index.
+
+    ``AND NOT`` is planned as a set difference, only a bare ``NOT`` and
+    ``empty:`` need all indexed files in ``scope``.  Regular expressions
+    are matched once per distinct key, on the keys which contain all
+    trigrams of its literals.
 
     Args:
-        string: A string to substitute.
+        node: A query tree from ``parse_query``.
+        scope: A SQL condition on ``path`` and its parameters.
 
-    returns:
-        string: A string whitout any non ascii characters.
+    Returns:
+        set: The absolute filenames of the matching files.
 
     """
 
-    table = {ord("ß"): "sz",
-             # a
-             ord("ä"): "ae",
-             ord("æ"): "ae",
-             ord("à"): "a",
-             ord("á"): "a",
-             ord("â"): "a",
-             ord("ã"): "a",
-             ord("å"): "a",
-             # e
-             ord("è"): "e",
-             ord("é"): "e",
-             ord("ê"): "e",
-             ord("ë"): "e",
-             # i
-             ord("ì"): "i",
-             ord("í"): "i",
-             ord("î"): "i",
-             ord("ï"): "i",
-             # n
-             ord("ñ"): "n",
-             ord("ņ"): "n",
-             ord("ň"): "n",
-             ord("ŉ"): "n",
-             ord("ŋ"): "n",
-             # o
-             ord("ö"): "oe",
-             ord("ò"): "o",
-             ord("ó"): "o",
-             ord("ô"): "o",
-             ord("õ"): "o",
-             ord("ø"): "o",
-             ord("õ"): "o",
-             ord("ō"): "o",
-             ord("ő"): "o",
-             ord("ǒ"): "o",
-             ord("ȱ"): "o",
-             # r
-             ord("ŕ"): "r",
-             ord("ŗ"): "r",
-             ord("ř"): "r",
-             # s
-             ord("ś"): "s",
-             ord("ŝ"): "s",
-             ord("ş"): "s",
-             ord("š"): "s",
-             ord("ś"): "s",
-             # c
-             ord("ć"): "c",
-             ord("ĉ"): "c",
-             ord("ċ"): "c",
-             ord("č"): "c",
-             # u
-             ord("ü"): "ue",
-             ord("ù"): "u",
-             ord("ú"): "u",
-             ord("û"): "u",
-             ord("ů"): "u",
-             ord("ũ"): "u",
-             ord("ũ"): "u",
-             ord("ŭ"): "u",
-             ord("ű"): "u",
-             ord("ų"): "u",
-             }
-
-    return string.translate(table)
+    op = node[0]
+    where, params = scope
 
+    if op == "and":
+        a, b = node[1], node[2]
+        if a[0] == "not":
+            a, b = b, a
+        retval = query_index(a, scope)
+        if not retval:
+            return retval
+        if b[0] == "not":
+            return retval - query_index(b[1], scope)
+        return retval & query_index(b, scope)
+
+    if op == "or":
+        return query_index(node[1], scope) | query_index(node[2], scope)
+
+    if op in ("not", "empty"):
+        rows = index_execute("SELECT path FROM tags WHERE " + where, params)
+        if op == "not":
+            return {r[0] for r in rows} - query_index(node[1], scope)
+        return {r[0] for r in rows} - {r[0] for r in index_execute(
+            "SELECT path FROM postings JOIN keys USING (id) "
+            "WHERE tag = ? AND key != '' AND " + where, [node[1]] + params)}
+
+    if op == "has":
+        rows = index_execute("SELECT path FROM postings JOIN keys USING (id) "
+                             "WHERE tag = ? AND " + where, [node[1]] + params)
+        return {r[0] for r in rows}
+
+    if op == "eq":
+        rows = index_execute("SELECT path FROM postings JOIN keys USING (id) "
+                             "WHERE tag = ? AND key = ? AND " + where,
+                             [node[1], node[2].lower()] + params)
+        return {r[0] for r in rows}
+
+    if op == "prefix":
+        key = node[2].lower()
+        rows = index_execute("SELECT path FROM postings JOIN keys USING (id) "
+                             "WHERE tag = ? AND key >= ? AND key < ? AND " +
+                             where,
+                             [node[1], key, key + chr(0x10ffff)] + params)
+        return {r[0] for r in rows}
+
+    r = query_regex(node[2])
+    tris = sorted(set().union(*map(trigrams_of, regex_literals(node[2]))))
+
+    if tris:
+        rows = index_execute(
+            "SELECT id, key FROM keys WHERE tag = ? AND id IN ("
+            "SELECT id FROM trigrams WHERE tri IN ({0}) "
+            "GROUP BY id HAVING count(*) = ?)".format(
+                ",".join("?" * len(tris))), [node[1]] + tris + [len(tris)])
+    else:
+        rows = index_execute("SELECT id, key FROM keys WHERE tag = ?",
+                             (node[1],))
 
-def samedir(ls):
-    """Test if all files are in the same directorie.
+    retval = set()
+    for batch in batched([i for i, key in rows if r.match(key)], 512):
+        retval.update(r[0] for r in index_execute(
+            "SELECT path FROM postings WHERE id IN ({0}) AND {1}".format(
+                ",".join("?" * len(batch)), where), batch + params))
+
+    return retval
+
+
+def query_tags(ls, node, recursiv=False, jobs=1, indexed=False):
+    """Finds the audio files in ``ls`` matching a query.
+
+    Unless ``indexed`` is set, the files are walked and stale index entries
+    are parsed again before the query runs on the index.  Without an index,
+    ``indexed`` or not, the query is evaluated file by file.
 
     Args:
-        fl: A list of absolute filenames.
+        ls: An iterable of files/directories.
+        node: A query string or a query tree from ``parse_query``.
+        recursiv: Find files recursivly.  ``bool``
+        jobs: The number of processes reading tags.  ``int``
+        indexed: Trust the index instead of walking the files.  ``bool``
 
     Returns:
-        bool
-
-    Raises:
-        ...
+        list: The matching filenames, in walk order or sorted if
+            ``indexed`` is set.
 
     """
 
-    if not isinstance(ls, list):
-        raise TypeError
+    if isinstance(node, str):
+        node = parse_query(node)
 
-    if len(ls) == 0:
-        raise ValueError
+    if open_index() is None:
+        fl = iwalk(ls, recursiv=recursiv, test=isaudio)
+        return [fn for fn, tags in iter_tags(fl, jobs=jobs, props=False)
+                if tags and query_match(node, tags)]
 
-    def recursion(index):
+    ls = list(ls)
+    scope = query_scope(ls, recursiv) if len(ls) <= QUERYSCOPE else \
+        ("1", [])
 
-        if index == len(ls) or len(ls) == 1:
-            return True
+    if not indexed:
+        fl = iwalk(ls, recursiv=recursiv, test=isaudio)
+        files = {os.path.abspath(fn): fn
+                 for fn, _ in iter_tags(fl, jobs=jobs, props=False)}
+        index_post()
+        paths = query_index(node, scope)
+        return [fn for path, fn in files.items() if path in paths]
 
-        if os.path.dirname(ls[index]) != os.path.dirname(ls[0]):
-            return False
+    index_post()
 
-        return recursion(index+1)
+    if len(ls) <= QUERYSCOPE:
+        return sorted(query_index(node, scope))
 
-    return recursion(1)
+    paths = query_index(node, scope)
+    return [fn for fn in index_walk(ls, recursiv=recursiv) if fn in paths]
 
 
-def has_coretags(tags):
-    """Test if the file contain all core tags.
+def tc_grep(argv):
+    """
+    """
 
-    Args:
-        fh: A taglib.File instance.
+    parser = argparse.ArgumentParser(prog="tagcat [grep|g]")
+    parser.add_argument("files", metavar="FILE", nargs="+")
+    parser.add_argument("-R", "--recursiv", action="store_true")
 
-    Returns:
-        bool: Wether the file has all core tags or not.
+    parser.add_argument("-t", "--tags", action="append")
+    parser.add_argument("-r", "--regexp", default="")
+    parser.add_argument("-q", "--query")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("-I", "--indexed", action="store_true")
 
-    Raises:
-        ...
+    args = parser.parse_args(argv)
 
-    """
+    nodes = [("re", query_tag(t), args.regexp) for t in args.tags or []]
+    if nodes:
+        nodes = [functools.reduce(lambda a, b: ("or", a, b), nodes)]
 
-    if not isinstance(tags, dict):
-        raise TypeError
+    if args.query:
+        try:
+            nodes.append(parse_query(args.query))
+        except ValueError as e:
+            parser.error("query: {0}".format(e))
 
-    if all(k in tags for k in ("ARTIST",
-                               "ALBUMARTIST",
-                               "ALBUM",
-                               "TITLE",
-                               "TRACKNUMBER")):
-        return True
+    if not nodes:
+        parser.error("one of -t or -q is required")
 
-    return False
+    node = functools.reduce(lambda a, b: ("and", a, b), nodes)
 
+    for fn in query_tags(args.files, node, recursiv=args.recursiv,
+                         jobs=args.jobs, indexed=args.indexed):
+        print(fn)
 
-def gen_filename(fn):
-    """Generates the file name based on the tag data.
+
+def payload_span(fn):
+    """Finds the audio payload of a MP3 or FLAC file, without the ID3v2,
+    ID3v1 and APEv2 tags and the FLAC metadata blocks.
+
+    Returns:
+        tuple: The start and end offset of the payload.
 
     """
 
-    if not isinstance(fn, str):
-        raise TypeError
+    with open(fn, "rb") as fd:
+        size = os.fstat(fd.fileno()).st_size
+        if not size:
+            return 0, 0
 
-    fh = taglib.File(fn)
-    tags = fh.tags
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _payload_span(mm, size)
 
-    if not has_coretags(tags):
-        raise ValueError("`{0}` need coretags".format(fn))
 
-    tracknr = int(fh.tags["TRACKNUMBER"][0].split("/")[0])
-    # disc = fh.tags["DISCNUMBER"] if "DISCNUMBER" in fh.tags else ""
-    artist = tagval_mutation(fh.tags["ARTIST"])
-    title = tagval_mutation(fh.tags["TITLE"])
-    album = tagval_mutation(fh.tags["ALBUM"])
-    albumartist = tagval_mutation(fh.tags["ALBUMARTIST"])
-    ending = os.path.splitext(fn)[1]
+def _payload_span(mm, size):
+    """Does the work of ``payload_span`` on a memory map.
+    """
 
-    filename = "{0:02d}-{1}-{2}{3}".format(tracknr, artist, title, ending)
-    dirname = os.path.join(BASEDIR, albumartist, album)
+    start, end = 0, size
 
-    return os.path.normpath(os.path.join(dirname, filename))
+    # ID3v2 header, size is syncsafe and without the header (and footer)
+    while mm[start:start+3] == b"ID3" and start + 10 <= end:
+        b = mm[start+6:start+10]
+        start += 10 + (b[0] << 21 | b[1] << 14 | b[2] << 7 | b[3])
+        if mm[start-10+5] & 0x10:
+            start += 10
 
+    # FLAC metadata blocks
+    if mm[start:start+4] == b"fLaC":
+        start += 4
+        while start + 4 <= end:
+            header = mm[start]
+            start += 4 + int.from_bytes(mm[start+1:start+4], "big")
+            if header & 0x80:
+                break
 
-def rename(ls, dry=False):
-    """Renames an audiofile based on its tags.
+    # ID3v1 and APEv2 tags at the end
+    if end - 128 >= start and mm[end-128:end-125] == b"TAG":
+        end -= 128
 
-    Args:
-        ls: A list of filenames.
+    if end - 32 >= start and mm[end-32:end-24] == b"APETAGEX":
+        flags = int.from_bytes(mm[end-12:end-8], "little")
+        end -= int.from_bytes(mm[end-20:end-16], "little")
+        if flags & 0x80000000:
+            end -= 32
 
-    Returns:
-        None
+    return min(start, size), max(min(end, size), min(start, size))
 
-    Raises:
-        ...
+
+def payload_hash(fn):
+    """Hashes the audio payload of ``fn`` through a memory map.
+
+    Returns:
+        str: The hex digest or None if ``fn`` can't be read.
 
     """
 
-    if not isinstance(ls, list):
-        raise TypeError
+    try:
+        with open(fn, "rb") as fd:
+            if not os.fstat(fd.fileno()).st_size:
+                return hashlib.blake2b().hexdigest()
 
-    def recursion(index):
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start, end = _payload_span(mm, len(mm))
+                h = hashlib.blake2b(memoryview(mm)[start:end])
+                return h.hexdigest()
+    except (OSError, ValueError):
+        return None
 
-        # end recursion
-        if index == len(ls):
-            return None
 
-        # do stuff
-        fn = ls[index]
-        dest = gen_filename(fn)
+def hash_lookup(fn):
+    """Returns the cached payload hash of ``fn`` if it is still valid.
+    """
 
-        if os.path.exists(dest):
-            raise NotImplementedError
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None, None
 
-        if not dry:
+    rows = index_execute("SELECT size, mtime, hash FROM hashes "
+                         "WHERE path = ?", (os.path.abspath(fn),))
 
-            if not os.path.exists(os.path.dirname(dest)):
-                os.makedirs(os.path.dirname(dest))
+    if rows and rows[0][0] == st.st_size and rows[0][1] == st.st_mtime_ns:
+        return st, rows[0][2]
 
-            os.rename(fn, dest)
+    return st, None
 
-        print(fn, " > ", dest)
 
-        # the recursion
-        return recursion(index+1)
+def find_dupes(ls, jobs=1):
+    """Finds files with the same audio payload.
 
-    # start recursion and default values
-    return recursion(0)
+    Files are grouped by payload size and length first, only files which
+    share both with another file are hashed.  Hashes are cached in the
+    index by path, size and mtime.
 
+    Args:
+        ls: An iterable of filenames.
+        jobs: The number of processes hashing files.
+
+    Returns:
+        list: A list of lists of duplicate filenames.
 
-def tc_rename(argv):
     """
+
+    buckets = collections.defaultdict(list)
+
+    for fn, tags in iter_tags(ls, jobs=jobs):
+        if not tags:
+            continue
+        try:
+            start, end = payload_span(fn)
+        except (OSError, ValueError):
+            continue
+        buckets[(end - start, tags.get("lenght", [""])[0])].append(fn)
+
+    candidates = [fn for b in buckets.values() if len(b) > 1 for fn in b]
+    hashes = {}
+    todo = []
+
+    for fn in candidates:
+        st, h = hash_lookup(fn)
+        if h is None and st is not None:
+            todo.append((fn, st))
+        hashes[fn] = h
+
+    if todo:
+        if jobs > 1:
+            import multiprocessing
+
+            with multiprocessing.Pool(jobs) as pool:
+                results = list(pool.imap(payload_hash,
+                                         [fn for fn, _ in todo], 16))
+        else:
+            results = [payload_hash(fn) for fn, _ in todo]
+
+        for (fn, st), h in zip(todo, results):
+            hashes[fn] = h
+            if h is None:
+                continue
+            try:
+                index_execute("INSERT OR REPLACE INTO hashes "
+                              "VALUES (?, ?, ?, ?)",
+                              (os.path.abspath(fn), st.st_size,
+                               st.st_mtime_ns, h))
+            except sqlite3.OperationalError as err:
+                index_warn(err)
+            else:
+                index_written()
+
+    groups = collections.defaultdict(list)
+    for fn in candidates:
+        if hashes[fn] is not None:
+            groups[hashes[fn]].append(fn)
+
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def tc_dupes(argv):
+    """Parses cmd arguments and runs find_dupes.
     """
 
-    parser = argparse.ArgumentParser(prog="tagcat [rename|ren]")
+    parser = argparse.ArgumentParser(prog="tagcat [dupes|du]")
     parser.add_argument("files", metavar="FILE", nargs="+")
     parser.add_argument("-r", "--recursiv", action="store_true")
-    parser.add_argument("-d", "--dry", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
 
     args = parser.parse_args(argv)
 
-    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
-    rename(filelist, dry=args.dry)
+    files = iwalk(args.files, recursiv=args.recursiv, test=isaudio)
+    for group in find_dupes(files, jobs=args.jobs):
+        print("\n".join(group))
+        print()
 
 
-def tc_auto(argv):
+def export_tags(ls, out=None, jobs=1, props=True):
+    """Writes the tags of every file as one JSON object per line.
+
+    Args:
+        ls: An iterable of filenames.
+        out: A writable text file, defaults to stdout.
+        jobs: The number of processes reading tags.
+        props: Include the audio properties (``PROPS``).  ``bool``
+
     """
+
+    out = out or os.sys.stdout
+
+    for fn, tags in iter_tags(ls, jobs=jobs, props=props):
+        if not tags:
+            print("Warning: {0}".format(fn), file=os.sys.stderr)
+            continue
+        out.write(json.dumps(tags, ensure_ascii=False, sort_keys=True))
+        out.write("\n")
+
+
+def tc_export(argv):
+    """Parses cmd arguments and runs export_tags.
+
+    Usage:
+        tagcat export -r testfiles/ > tags.ndjson
+
     """
 
-    parser = argparse.ArgumentParser(prog="tagcat [rename|ren]")
+    parser = argparse.ArgumentParser(prog="tagcat [export|ex]")
     parser.add_argument("files", metavar="FILE", nargs="+")
     parser.add_argument("-r", "--recursiv", action="store_true")
-    parser.add_argument("-d", "--dry", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--no-props", dest="props", action="store_false")
 
     args = parser.parse_args(argv)
 
-    filelist = filewalk(args.files, recursiv=args.recursiv, test=isaudio)
+    files = iwalk(args.files, recursiv=args.recursiv, test=isaudio)
+    export_tags(files, jobs=args.jobs, props=args.props)
 
-    # list tags first
-    tags = merge_tags(filelist)
-    print_tags(tags)
 
-    if input("Exit: ") == "y":
-        os.sys.exit(2)
+def import_tags(lines, dry=False, jobs=1, batch=1024):
+    """Replaces the tags of files with the records of an export.
 
-    if input("Set 'ALBUMARTIST': ") == "y":
-        set_albumartist(filelist)
+    Every line is a JSON object like ``read_tags`` returns it.  The file
+    named by ``path`` gets exactly the tags of the record, the audio
+    properties are ignored.  Files whose tags don't change are not saved.
+    The lines are processed in batches of ``batch`` records, so the memory
+    use doesn't depend on the length of the input.  Malformed lines and
+    files that can't be tagged are reported and skipped.
 
-    # chmod
-    chmod(filelist)
+    Args:
+        lines: An iterable of JSON lines.
+        dry: Don't save the files.  ``bool``
+        jobs: The number of files processed at once.  ``int``
+        batch: The number of records per batch.  ``int``
 
-    # cleanup
-    clear_tags(filelist, dry=args.dry)
+    Returns:
+        tuple: The number of touched and of skipped files.
 
-    # cover
-    rename_cover(filelist)
+    """
 
-    # rename
-    rename(filelist, dry=True)
-    if input("Rename: ") != "y":
-        os.sys.exit(2)
-    rename(filelist, dry=args.dry)
+    touched = skipped = 0
 
-    # cover
-    pass
+    def run(fn):
+        if journaled("tag", fn):
+            return False
+        try:
+            changed = mutate_file(fn, plan[fn], dry=dry)
+        except Exception as err:
+            print("Warning: {0}: {1}".format(fn, str(err) or
+                                             type(err).__name__),
+                  file=os.sys.stderr)
+            return None
+        if not dry:
+            journal("tag", fn)
+        return changed
 
+    for records in batched(((i, l) for i, l in enumerate(lines, 1)
+                            if l.strip()), batch):
+        plan = {}
+        for i, line in records:
+            try:
+                rec = json.loads(line)
+                if not isinstance(rec, dict) or not rec.get("path"):
+                    raise ValueError("not a record with a path")
+                for t, v in rec.items():
+                    if not isinstance(v, list) or \
+                            not all(isinstance(x, str) for x in v):
+                        raise ValueError("{0} is not a list of strings"
+                                         .format(t))
+            except ValueError as err:
+                print("Warning: line {0}: {1}".format(i, err),
+                      file=os.sys.stderr)
+                skipped += 1
+                continue
+
+            fn = rec["path"][0]
+
+            tags = {t: v for t, v in rec.items()
+                    if t != "path" and t not in PROPS}
+            plan[fn] = [("replace", tags)]
+
+        if jobs > 1:
+            results = aio_map(run, list(plan), limit=jobs)
+        else:
+            results = ((fn, run(fn)) for fn in plan)
 
-def chmod(ls):
-    """
-    """
+        for fn, changed in results:
+            if changed is None:
+                skipped += 1
+            elif changed:
+                touched += 1
+            else:
+                skipped += 1
 
-    def recursion(index):
+    return touched, skipped
 
-        if index == len(ls):
-            return None
 
-        # do stuff
-        os.chmod(ls[index], mode=0o644)
+def tc_import(argv):
+    """Parses cmd arguments and runs import_tags.
 
-        # recursion
-        return recursion(index+1)
+    Usage:
+        tagcat import -j 8 tags.ndjson
 
-    return recursion(0)
+    """
 
+    parser = argparse.ArgumentParser(prog="tagcat [import|im]")
+    parser.add_argument("file", metavar="FILE", nargs="?", default="-")
+    parser.add_argument("-d", "--dry", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
 
-def equal_tags(ls, tag):
-    """Checks if `tag` is equal in all files.
-    """
+    args = parser.parse_args(argv)
 
-    if not isinstance(ls, list):
-        raise TypeError
+    if args.file == "-":
+        counts = import_tags(os.sys.stdin, dry=args.dry, jobs=args.jobs)
+    else:
+        with open(args.file, encoding="utf-8") as fd:
+            counts = import_tags(fd, dry=args.dry, jobs=args.jobs)
 
-    if not len(ls):
-        raise ValueError
+    print_summary(counts)
 
-    def recursion(index):
 
-        if index == len(ls):
-            return True
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCHMASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+             IN_DELETE)
 
-        # do stuff
-        try:
-            if ls[0][tag] != ls[index][tag]:
-                raise KeyError
-        except KeyError:
-            return False
 
-        return recursion(index+1)
+class Inotify(object):
+    """A minimal inotify binding through ctypes.
+    """
 
-    return recursion(1)
+    def __init__(self):
+        import ctypes.util
 
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                 use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        self.wds = {}
 
-def has_tags(ls, tag):
-    """
-    """
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
 
-    if not isinstance(ls, list):
-        raise TypeError
+    def add(self, path):
+        """Watches the directorie ``path``.
+        """
 
-    if not len(ls):
-        raise ValueError("`ls` is empty")
+        import ctypes
 
-    def recursion(index):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                          WATCHMASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed",
+                          path)
+        self.wds[wd] = path
 
-        if index == len(ls):
-            return True
+    def add_tree(self, path):
+        """Watches ``path`` and all directories below it.
+        """
 
-        # do stuff
-        try:
-            if not ls[index][tag]:
-                raise KeyError
-        except KeyError:
-            return False
+        stack = [path]
+        while stack:
+            d = stack.pop()
+            try:
+                self.add(d)
+                with os.scandir(d) as it:
+                    stack.extend(e.path for e in it
+                                 if e.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def read(self):
+        """Reads pending events.
+
+        Returns:
+            list: A list of ``(mask, path)`` tuples.
+
+        """
+
+        data = os.read(self.fd, 1 << 16)
+        retval = []
+        i = 0
+
+        while i < len(data):
+            wd, mask, _, size = struct.unpack_from("iIII", data, i)
+            name = data[i+16:i+16+size].rstrip(b"\0")
+            i += 16 + size
+
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+            elif wd in self.wds:
+                retval.append((mask, os.path.join(self.wds[wd],
+                                                  os.fsdecode(name))))
+            else:
+                retval.append((mask, None))
 
-        return recursion(index+1)
+        return retval
 
-    return recursion(0)
+    def close(self):
+        """Closes the inotify instance.
+        """
 
+        os.close(self.fd)
 
-def set_albumartist(ls):
-    """
-    """
-    aa = input("{0}: ".format("albumartist".upper()))
-    tags = {"ALBUMARTIST": aa}
-    write_tags(ls, tags)
 
+def watch(roots, delay=2.0, scan=True):
+    """Keeps the tag index of the files below ``roots`` up to date.
+
+    Changes are collected until no event arrived for ``delay`` seconds (or
+    for at most ten times ``delay``) and the changed files are then reparsed
+    into the index in one go.
+
+    Args:
+        roots: A list of directories.
+        delay: The debounce delay in seconds.  ``float``
+        scan: Index all files below ``roots`` first.  ``bool``
 
-def rename_cover(ls):
-    """
     """
 
-    if not samedir(ls):
-        raise ValueError("Files must live in the same directorie")
+    ino = Inotify()
+    roots = [os.path.abspath(d) for d in roots]
+    pending = set()
+    since = None
 
-    jpgs = filewalk([os.path.dirname(ls[0])], recursiv=True, test=isjpg)
+    for d in roots:
+        ino.add_tree(d)
 
-    if len(jpgs) == 1:
+    if scan:
+        pending.update(iwalk(roots, recursiv=True, test=isaudio))
+        since = 0
 
-        dest = os.path.join(os.path.dirname(gen_filename(ls[0])), "cover.jpg")
+    try:
+        while True:
+            timeout = None if since is None else delay
+            if select.select([ino.fd], [], [], timeout)[0]:
+                for mask, path in ino.read():
+                    if mask & IN_Q_OVERFLOW or path is None:
+                        pending.update(iwalk(roots, recursiv=True,
+                                             test=isaudio))
+                    elif mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            ino.add_tree(path)
+                            pending.update(iwalk([path], recursiv=True,
+                                                 test=isaudio))
+                        elif mask & (IN_DELETE | IN_MOVED_FROM):
+                            index_del_tree(path)
+                    elif path.endswith(AUDIOEXT):
+                        pending.add(path)
+
+                if since is None:
+                    since = time.monotonic()
+
+                if time.monotonic() - since < 10 * delay:
+                    continue
+
+            # taglib opens files writable, so parsing a file raises another
+            # IN_CLOSE_WRITE.  Only files with a stale entry are reparsed.
+            # While another tagcat holds the index, the files stay pending
+            # and the next flush retries them.
+            n = 0
+            retry = set()
+            for fn in pending:
+                if not isaudio(fn):
+                    if not index_del(fn):
+                        retry.add(fn)
+                    continue
+
+                st, tags = index_lookup(fn)
+                if st is None or tags is not None:
+                    continue
+
+                tags = read_tags(fn)
+                if tags and not index_put(fn, tags, st):
+                    retry.add(fn)
+                else:
+                    n += 1
+
+            if not commit_index():
+                retry = set(pending)
+            elif n:
+                print("indexed {0} files".format(n))
+
+            pending = retry
+            since = time.monotonic() if pending else None
+    finally:
+        ino.close()
+
+
+def tc_watch(argv):
+    """Parses cmd arguments and runs watch.
+    """
 
-        if not os.path.exists(os.path.dirname(dest)):
-            os.makedirs(os.path.dirname(dest))
+    parser = argparse.ArgumentParser(prog="tagcat [watch|w]")
+    parser.add_argument("dirs", metavar="DIR", nargs="*", default=[BASEDIR])
+    parser.add_argument("-d", "--delay", type=float, default=2.0)
+    parser.add_argument("--no-scan", dest="scan", action="store_false")
 
-        print("{0} > {1}".format(jpgs[0], dest))
+    args = parser.parse_args(argv)
 
-        os.rename(jpgs[0], dest)
+    try:
+        watch(args.dirs, delay=args.delay, scan=args.scan)
+    except KeyboardInterrupt:
+        pass
 
-    # todo: choose cover image
-    pass
 
+def shell(lines, out=None):
+    """Runs newline-delimited commands through ``dispatch``.
 
-def grep_tags(ls, stags, regexp):
-    """Greps for ...
+    A line has the same syntax as the arguments of ``tagcat``, without the
+    global options.  Errors, usage messages included, are reported to
+    ``out`` and don't stop the shell.
 
     Args:
-        ls: A list of filenames.
-        stags: A list of tagfields to search in.
-        regexp: The regular expression.
+        lines: An iterable of command lines.
+        out: A writable text stream, defaults to stdout.
 
-    Returns:
-        list: A list of filenames.
+    """
 
-    Raises:
-        TypeError: If `ls` is not a list
+    out = out or os.sys.stdout
 
+    for line in lines:
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as e:
+            print("tagcat: {0}".format(e), file=out)
+            continue
+
+        if not argv:
+            continue
+
+        try:
+            with contextlib.redirect_stdout(out), \
+                    contextlib.redirect_stderr(out):
+                dispatch(argv[0], argv[1:])
+        except SystemExit:
+            pass
+        except UnknownCommand:
+            print("tagcat: unknown command '{0}'".format(argv[0]), file=out)
+        except Exception as e:
+            print("tagcat: {0}: {1}".format(argv[0],
+                                            str(e) or type(e).__name__),
+                  file=out)
+        finally:
+            commit_index()
+            if _mempool is not None and \
+                    len(_mempool) > 2 * _mempool_live + MEMPOOLSLACK:
+                prune_mempool()
+            out.flush()
+
+
+def prune_mempool():
+    """Reinterns the records of ``_memo`` into a new pool, so the values of
+    replaced and removed entries are freed.
     """
 
-    if not isinstance(ls, list):
-        raise TypeError
+    global _mempool, _mempool_live
 
-    if not isinstance(stags, list):
-        raise TypeError("`stags` must be a list")
+    pool = {}
+    for _, _, record in _memo.values():
+        record.keys = intern(pool, tuple(intern(pool, t)
+                                         for t in record.keys))
+        record.values = tuple(intern_values(pool, v) for v in record.values)
 
-    r = re.compile(regexp, re.I)
+    _mempool = pool
+    _mempool_live = len(pool)
 
-    def recursion(index, retval):
 
-        # basecase
-        if index == len(ls):
-            return retval
+def serve(path):
+    """Runs ``shell`` for every connection on the Unix socket ``path``.
 
-        # do stuff
-        try:
-            f = taglib.File(ls[index])
-        except OSError:
-            f = None
-            print("Warning: {0}".format(ls[index]))
+    Connections are served one after another, a client sends its commands,
+    shuts down its writing side and reads the output until the server
+    closes the connection.
+    """
 
-        if f:
-            for t in stags:
-                t = t.upper()
-                if t in f.tags and r.match(f.tags[t][0]):
-                    retval.append(ls[index])
-                    print(ls[index])
-            f.close()
+    import socket
 
-        # the recursion
-        return recursion(index+1, retval)
+    if os.path.exists(path):
+        os.unlink(path)
 
-    # start recusrion and set default values
-    return recursion(0, [])
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 
+    try:
+        server.bind(path)
+        server.listen()
 
-def tc_grep(argv):
-    """
-    """
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile("r") as rfd, conn.makefile("w") as wfd:
+                shell(rfd, out=wfd)
+    finally:
+        server.close()
+        os.unlink(path)
 
-    parser = argparse.ArgumentParser(prog="tagcat [grep|g]")
-    parser.add_argument("files", metavar="FILE", nargs="+")
-    parser.add_argument("-R", "--recursiv", action="store_true")
 
-    parser.add_argument("-t", "--tags", action="append")
-    parser.add_argument("-r", "--regexp", default="")
+def tc_shell(argv):
+    """Keeps tagcat running and reads commands from stdin or a socket.
 
-    args = parser.parse_args(argv)
+    Walked file lists and parsed tags stay in memory between commands and
+    are only read again if a directorie or file mtime changes.
+    """
 
-    fl = filewalk_i(args.files, recursiv=args.recursiv, test=isaudio)
-    grep_tags(fl, args.tags, args.regexp)
+    global _memo, _mempool, _mempool_live, _walkmemo
 
-    # for f in match:
-        # print(f)
-        # # print(f.replace(BASEDIR, "~ "))
+    parser = argparse.ArgumentParser(prog="tagcat shell")
+    parser.add_argument("-s", "--socket", metavar="PATH")
+    args = parser.parse_args(argv)
 
+    _memo = {}
+    _mempool = {}
+    _mempool_live = 0
+    _walkmemo = {}
 
+    try:
+        if args.socket:
+            serve(args.socket)
+        else:
+            shell(os.sys.stdin)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _memo = None
+        _mempool = None
+        _walkmemo = None
 
 
 if __name__ == "__main__":